@@ -2,16 +2,42 @@ import sys
 import pathlib
 import shutil
 import os
+import time
+import io
+import mmap
+import json
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 # get command line argument. skipping the first one (MergeAhmEpc.py --temp-dir=/tmp/32145)
 args = sys.argv[1:]
 
+# maximum number of catalog files held open at once while splitting the raw file
+max_open_files = 256
+# number of processes used to split the raw file. 1 keeps the single pass reader. every worker can hold max_open_files
+# buffered writers, so the 1 MiB write buffer is divided between the workers. with its 64 KiB floor that keeps the
+# buffers at 256 MiB up to 16 workers, and 16 MiB per worker beyond that
+workers = 1
+# files: one text file per catalog. index: a single catalog_index.json of byte runs into the raw file
+output_mode = 'files'
+# number of threads relocating catalog image directories
+image_workers = 8
+
 # parse out arguments and assign a base directory
 for arg in args:
 	arg = arg.split('=')
 	if arg[0] == '--temp-dir':
 		# set base_dir for all working files
 		base_dir = pathlib.Path(arg[1])
+	if arg[0] == '--max-open-files':
+		max_open_files = int(arg[1])
+	if arg[0] == '--workers':
+		workers = int(arg[1])
+	if arg[0] == '--output':
+		output_mode = arg[1]
+	if arg[0] == '--image-workers':
+		image_workers = int(arg[1])
 
 def get_raw_file():
 	ahm_dir = base_dir / 'ahm/data/'
@@ -36,50 +62,269 @@ def create_dir(dir):
 
 	return dir
 
-def parse_images(data_dir, working_dir):
+def relocate_catalog_images(catalog, working_dir):
+	# move a catalog image directory into working_dir. the move lands in a staging directory first, so the
+	# target only ever holds a complete copy. replacing an existing target takes two renames; if the run dies
+	# between them the previous copy is left in .<catalog>.old and is put back on the next run
+	target = working_dir / catalog.name
+	staging = working_dir / ('.' + catalog.name + '.incoming')
+	retired = working_dir / ('.' + catalog.name + '.old')
+	if retired.exists() and not target.exists():
+		os.rename(retired, target)
+	for path in (staging, retired):
+		if path.exists():
+			shutil.rmtree(str(path))
+
+	# this is a rename on the same volume and a copy across volumes
+	shutil.move(str(catalog), str(staging))
+	if target.exists():
+		os.rename(target, retired)
+		os.rename(staging, target)
+		shutil.rmtree(str(retired))
+	else:
+		os.rename(staging, target)
+
+def parse_images(data_dir, working_dir, worker_count=None):
 
+	if worker_count is None:
+		worker_count = image_workers
+
+	catalogs = []
 	for path in data_dir.iterdir():
 		if path.is_dir() and path.name.startswith('autodata'):
 			for catalog in path.iterdir():
 				if catalog.is_dir():
-					print(catalog.name)
-					# try to move the folder, if it fails, it already exists
-					try:
-						shutil.move(str(catalog), str(working_dir))
-					except:
-						# if it fails, remove the directory and then move the new files
-						shutil.rmtree(str(working_dir)+'/'+catalog.name)
-						shutil.move(str(catalog), str(working_dir))
+					catalogs.append(catalog)
+
+	start_time = time.perf_counter()
+	with ThreadPoolExecutor(max_workers=worker_count) as executor:
+		futures = {executor.submit(relocate_catalog_images, catalog, working_dir): catalog for catalog in catalogs}
+		for count, future in enumerate(as_completed(futures), 1):
+			future.result()
+			elapsed = max(time.perf_counter() - start_time, 1e-9)
+			print('images: %s (%d/%d catalogs, %.1f catalogs/sec)' % (futures[future].name, count, len(catalogs), count / elapsed))
+
+	return len(catalogs)
+
+class CatalogWriterPool:
+	# LRU pool of open, buffered catalog files. rows are appended to <catalog_id>.txt in working_dir,
+	# the least recently used file is flushed and closed once max_open files are open
+
+	def __init__(self, working_dir, max_open=256, buffer_size=1024*1024):
+		self.working_dir = working_dir
+		self.max_open = max_open
+		self.buffer_size = buffer_size
+		self.writers = OrderedDict()
+
+	def write(self, catalog_id, row):
+		writer = self.writers.get(catalog_id)
+		if writer is None:
+			# evict the least recently used file before opening a new one
+			if len(self.writers) >= self.max_open:
+				_, evicted = self.writers.popitem(last=False)
+				evicted.close()
+			file_path = self.working_dir / (catalog_id + ".txt")
+			writer = open(file_path, "a", buffering=self.buffer_size)  # append mode
+			self.writers[catalog_id] = writer
+		else:
+			self.writers.move_to_end(catalog_id)
+		writer.write(row)
+
+	def close(self):
+		while self.writers:
+			_, writer = self.writers.popitem(last=False)
+			writer.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+def print_throughput(label, rows, byte_count, start_time):
+	elapsed = max(time.perf_counter() - start_time, 1e-9)
+	print('%s: %d rows, %.1f MB in %.1fs (%d rows/sec, %.1f MB/sec)' % (label, rows, byte_count / 1e6, elapsed, rows / elapsed, byte_count / 1e6 / elapsed))
+
+def get_pool_context():
+	# the image relocation threads are still running while the split pools start, and forking a process
+	# with live threads is unsafe. spawned workers start clean and only need the module level functions
+	return multiprocessing.get_context('spawn')
+
+def get_split_ranges(file, count):
+	# divide the file into count byte ranges, each ending just after a newline
+	if os.path.getsize(file) == 0:
+		return []
+	with open(file, 'rb') as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		size = len(mm)
+		ranges = []
+		start = 0
+		for x in range(1, count + 1):
+			if x == count:
+				end = size
+			else:
+				end = mm.find(b'\n', max(size * x // count, start))
+				end = size if end == -1 else end + 1
+			if end > start:
+				ranges.append((start, end))
+			start = end
+	return ranges
+
+def iter_range_rows(mm, start, end, block_size=64*1024*1024):
+	# yield rows from a newline aligned byte range, reading it in blocks that also end on a newline.
+	# rows are decoded the same way as the single pass reader (latin-1, universal newlines)
+	while start < end:
+		stop = mm.find(b'\n', min(start + block_size, end) - 1, end)
+		stop = end if stop == -1 else stop + 1
+		yield from io.StringIO(mm[start:stop].decode('latin-1'), newline=None)
+		start = stop
+
+def split_raw_range(file, start, end, shard_dir, max_open, buffer_size):
+	# worker: bucket the rows of one byte range into per catalog shard files
+	shard_dir.mkdir(parents=True, exist_ok=True)
+	rows = 0
+	with open(file, 'rb') as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		with CatalogWriterPool(shard_dir, max_open, buffer_size) as writers:
+			for row in iter_range_rows(mm, start, end):
+				writers.write(row[3:11].rstrip(), row)
+				rows += 1
+	return rows
+
+def merge_catalog_shards(file_name, shard_dirs, working_dir):
+	# append each worker's shard of a catalog in range order, which is the original row order
+	with open(working_dir / file_name, 'ab') as target:
+		for shard_dir in shard_dirs:
+			shard_path = shard_dir / file_name
+			if shard_path.is_file():
+				with open(shard_path, 'rb') as shard:
+					shutil.copyfileobj(shard, target, 1024*1024)
+
+def parse_raw_ahm_complete_file_parallel(file, working_dir, worker_count, max_open=None):
+
+	if max_open is None:
+		max_open = max_open_files
+
+	# share one pool's worth of write buffers between the workers, with a floor so rows are still written in blocks
+	buffer_size = max(1024*1024 // worker_count, 64*1024)
 
-def parse_raw_ahm_complete_file(file, working_dir):
+	start_time = time.perf_counter()
+	ranges = get_split_ranges(file, worker_count)
+	shard_root = working_dir / '_shards'
+	shard_dirs = [shard_root / str(x) for x in range(len(ranges))]
 
+	with ProcessPoolExecutor(max_workers=worker_count, mp_context=get_pool_context()) as executor:
+		# split: each worker buckets its own byte range
+		row_counts = list(executor.map(split_raw_range, [file] * len(ranges), [x[0] for x in ranges], [x[1] for x in ranges], shard_dirs, [max_open] * len(ranges), [buffer_size] * len(ranges)))
+		# merge: each catalog is assembled from its shards by one worker
+		file_names = sorted(set(path.name for shard_dir in shard_dirs if shard_dir.is_dir() for path in shard_dir.iterdir()))
+		list(executor.map(merge_catalog_shards, file_names, [shard_dirs] * len(file_names), [working_dir] * len(file_names)))
+
+	shutil.rmtree(str(shard_root))
+	print_throughput('split complete (%d workers)' % worker_count, sum(row_counts), sum(x[1] - x[0] for x in ranges), start_time)
+
+def parse_raw_ahm_complete_file(file, working_dir, max_open=None, report_every=1000000, worker_count=None):
+
+	if worker_count is None:
+		worker_count = workers
+	if worker_count > 1:
+		return parse_raw_ahm_complete_file_parallel(file, working_dir, worker_count, max_open)
+
+	if max_open is None:
+		max_open = max_open_files
+
+	rows = 0
+	byte_count = 0
+	start_time = time.perf_counter()
 	# Source file
-	with open(file, encoding='latin-1') as catalog_file:
+	with open(file, encoding='latin-1') as catalog_file, CatalogWriterPool(working_dir, max_open) as writers:
 		# iterate through rows in source file
 		for row in catalog_file:
 			row_catalog_id = row[3:11].rstrip()
 			# export catalog rows to file
-			file_name = row_catalog_id + ".txt"
-			file_path = working_dir / file_name
-			file = open(file_path, "a+")  # append mode
-			file.write(row)
-			file.close()
+			writers.write(row_catalog_id, row)
+			rows += 1
+			# latin-1 is one byte per character
+			byte_count += len(row)
+			if rows % report_every == 0:
+				print_throughput('split progress', rows, byte_count, start_time)
+
+	print_throughput('split complete', rows, byte_count, start_time)
+
+def index_raw_range(file, start, end):
+	# worker: map catalog id to [offset, length] runs for the rows of one byte range, joining adjacent rows into one run
+	catalog_runs = {}
+	with open(file, 'rb') as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		pos = start
+		while pos < end:
+			stop = mm.find(b'\n', pos, end)
+			stop = end if stop == -1 else stop + 1
+			# clamp to the row so a short row never reads into the next one. rstrip also drops the \r\n
+			row_catalog_id = mm[pos+3:min(pos+11, stop)].decode('latin-1').rstrip()
+			runs = catalog_runs.setdefault(row_catalog_id, [])
+			if runs and runs[-1][0] + runs[-1][1] == pos:
+				runs[-1][1] += stop - pos
+			else:
+				runs.append([pos, stop - pos])
+			pos = stop
+	return catalog_runs
+
+def build_catalog_index(file, worker_count=None):
+
+	if worker_count is None:
+		worker_count = workers
+
+	ranges = get_split_ranges(file, max(worker_count, 1))
+	if worker_count > 1:
+		with ProcessPoolExecutor(max_workers=worker_count, mp_context=get_pool_context()) as executor:
+			range_indexes = list(executor.map(index_raw_range, [file] * len(ranges), [x[0] for x in ranges], [x[1] for x in ranges]))
+	else:
+		range_indexes = [index_raw_range(file, x[0], x[1]) for x in ranges]
+
+	# combine the ranges in file order, joining runs that continue across a range boundary
+	catalog_index = {}
+	for range_index in range_indexes:
+		for row_catalog_id, runs in range_index.items():
+			catalog_runs = catalog_index.setdefault(row_catalog_id, [])
+			if catalog_runs and catalog_runs[-1][0] + catalog_runs[-1][1] == runs[0][0]:
+				catalog_runs[-1][1] += runs[0][1]
+				runs = runs[1:]
+			catalog_runs.extend(runs)
+
+	return catalog_index
+
+def write_catalog_index(file, working_dir, worker_count=None):
+
+	start_time = time.perf_counter()
+	catalog_index = build_catalog_index(file, worker_count)
+	index_path = working_dir / 'catalog_index.json'
+	with open(index_path, 'w') as index_file:
+		json.dump({'raw_file':str(pathlib.Path(file).resolve()), 'catalogs':catalog_index}, index_file, separators=(',', ':'))
+	print('indexed %d catalogs in %.1fs' % (len(catalog_index), time.perf_counter() - start_time))
+
+	return index_path
 
 if __name__ == "__main__":
 	# get new raw file from downloaded zip
 	file_path = get_raw_file()
 	print(file_path)
-	# create working directories
-	working_raw = create_dir('working/raw')
-	working_complete = create_dir('working/complete')
-	# process raw file into catalogs
-	parse_raw_ahm_complete_file(file_path, working_raw)
-	# merge files into complete directory
-	for path in working_raw.iterdir():
-		if path.is_file():
-			shutil.move(os.path.join(working_raw, path.name), os.path.join(working_complete, path.name))
-
-	# process image directories into a new folder for zip/FPSM upload
+	# process image directories into a new folder for zip/FPSM upload, alongside the text split
 	working_image = create_dir('working/image')
 	data_dir = get_data_dir()
-	parse_images(data_dir, working_image)
\ No newline at end of file
+	image_executor = ThreadPoolExecutor(max_workers=1)
+	image_future = image_executor.submit(parse_images, data_dir, working_image)
+	# create working directories
+	working_complete = create_dir('working/complete')
+	if output_mode == 'index':
+		# index catalogs in place instead of rewriting the raw file
+		write_catalog_index(file_path, working_complete)
+	else:
+		working_raw = create_dir('working/raw')
+		# process raw file into catalogs
+		parse_raw_ahm_complete_file(file_path, working_raw)
+		# merge files into complete directory
+		for path in working_raw.iterdir():
+			if path.is_file():
+				shutil.move(os.path.join(working_raw, path.name), os.path.join(working_complete, path.name))
+
+	# wait for the image relocation to finish
+	image_future.result()
+	image_executor.shutdown()
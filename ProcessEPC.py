@@ -1,18 +1,62 @@
 import pandas as pd
+import numpy as np
 import re
 import sys
 import pathlib
 from urllib.parse import quote_plus as urlquote
 from sqlalchemy.engine import create_engine
+from sqlalchemy import text
 import hashlib # md5 hash gen
 from PIL import Image
 import datetime
+import io
+import mmap
+import json
+import contextlib
+import collections
+import functools
+import shutil
+import os
+import importlib.util
+import pickle
+import zlib
+import time
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+# pyarrow is only needed for --export-format=parquet and feather ACES snapshots
+if importlib.util.find_spec('pyarrow'):
+	import pyarrow as pa
+	import pyarrow.parquet as pq
 
 # TODO: create empty rp_illustration_hotspots csv in the final exports
 
 # get command line argument. skipping the first one (MergeAhmEpc.py --temp-dir=/tmp/32145)
 args = sys.argv[1:]
 
+# optional catalog_index.json written by MergeEPC --output=index
+catalog_index_file = None
+# optional persistent directory for the incremental catalog manifest and reusable outputs
+cache_dir = None
+# database connection. --catalog-db overrides the catalog url, e.g. a local sqlite stand-in for development
+db_pass = None
+catalog_db_url = None
+# --offline uses the ACES snapshots in cache_dir without querying the catalog database
+offline = False
+# --refresh-aces rebuilds the ACES snapshots even if the fingerprint is unchanged
+refresh_aces = False
+# number of processes rendering illustration images
+image_workers = os.cpu_count() or 1
+# number of processes running catalogs in parallel. image rendering stays in each catalog's process when this is above 1
+workers = 1
+# format of the per catalog and combined exports: csv (read by the PHP importer) or parquet
+export_format = 'csv'
+# --spill-buckets=N spills illustration parts to N bucket files per catalog and classifies them bucket by bucket.
+# 0 keeps every catalog in memory
+spill_buckets = 0
+# --catalog=13SD201,13TL000 only runs the named catalogs. None runs every catalog
+catalog_names = None
+
 # parse out arguments and assign a base directory
 for arg in args:
 	arg = arg.split('=')
@@ -21,9 +65,46 @@ for arg in args:
 		base_dir = pathlib.Path(arg[1])
 	if arg[0] == '--db-pass':
 		db_pass = arg[1]
-
-# raw db connection
-catalog_engine = create_engine("mysql+pymysql://rp_read_only:%s@dev-catdb.revolutionparts.vpc/rp_834ce" % urlquote(db_pass))
+	if arg[0] == '--catalog-index':
+		catalog_index_file = pathlib.Path(arg[1])
+	if arg[0] == '--cache-dir':
+		cache_dir = pathlib.Path(arg[1])
+	if arg[0] == '--catalog-db':
+		catalog_db_url = '='.join(arg[1:])
+	if arg[0] == '--offline':
+		offline = True
+	if arg[0] == '--refresh-aces':
+		refresh_aces = True
+	if arg[0] == '--image-workers':
+		image_workers = int(arg[1])
+	if arg[0] == '--spill-buckets':
+		spill_buckets = int(arg[1])
+	if arg[0] == '--workers':
+		workers = int(arg[1])
+	if arg[0] == '--export-format':
+		export_format = arg[1]
+	if arg[0] == '--catalog':
+		catalog_names = set(arg[1].split(','))
+
+# raw db connection, created on first use
+catalog_engine = None
+
+def get_catalog_engine():
+	global catalog_engine
+	if catalog_engine is None:
+		if catalog_db_url is not None:
+			catalog_engine = create_engine(catalog_db_url)
+		else:
+			catalog_engine = create_engine("mysql+pymysql://rp_read_only:%s@dev-catdb.revolutionparts.vpc/rp_834ce" % urlquote(db_pass))
+	return catalog_engine
+
+def init_catalog_worker():
+	# forked workers inherit the parent's pooled db connections. drop them without closing the parent's sockets
+	# so each worker opens its own connections on first use
+	global catalog_engine
+	if catalog_engine is not None:
+		catalog_engine.dispose(close=False)
+		catalog_engine = None
 # set global path variables
 
 temp_raw_dir = pathlib.Path(base_dir / "working/epc/")
@@ -62,6 +143,32 @@ try:
 except FileExistsError:
 	pass
 
+class CatalogMetrics:
+	# stage timings and counters of one catalog. process_catalog replaces the module level catalog_metrics
+	# for each catalog, the pipeline functions add their counts to it
+
+	def __init__(self, catalog_name=None):
+		self.catalog_name = catalog_name
+		self.stages = collections.OrderedDict()
+		self.counts = collections.Counter()
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		# time a pipeline stage. a stage entered more than once accumulates
+		start_time = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - start_time
+
+	def count(self, name, value=1):
+		self.counts[name] += int(value)
+
+	def to_dict(self):
+		return {'stages':{x:round(y, 3) for x, y in self.stages.items()}, 'counts':dict(self.counts)}
+
+catalog_metrics = CatalogMetrics()
+
 # row definitions
 # sublists are [item length, number of occurrences]
 # Record Type 10 - Vehicle Header
@@ -98,6 +205,77 @@ def generate_slices(widths):
 				count += 1
 	return slices
 
+def compile_record_decoder(widths, fields):
+	# compile a record layout once into a decoder that returns only the named fields, in order.
+	# a field is a slice number, or a (start, stop) range of repeated option slots that decodes to the list of non-blank values
+	slices = generate_slices(widths)
+	getters = []
+	for position in fields.values():
+		if type(position) is tuple:
+			getters.append(tuple(slices[position[0]:position[1]]))
+		else:
+			getters.append(slices[position])
+	getters = tuple(getters)
+
+	def decode(row):
+		values = []
+		for getter in getters:
+			if type(getter) is tuple:
+				values.append([x for x in [row[s].rstrip() for s in getter] if x])
+			else:
+				values.append(row[getter].rstrip())
+		return values
+
+	return decode
+
+# compiled decoders for the fields the parser uses
+decode_record_10 = compile_record_decoder(record_10_widths, {
+	'catalog_id':1,        # catalog_df.catalog_id
+	'catalog_name':3,      # catalog_df.catalog_desc, vehicle_df.model (after stripping year info)
+	'product_div':4,       # catalog_df.division, vehicle_df.make (A = Honda, B = Acura)
+})
+decode_record_20 = compile_record_decoder(record_20_widths, {
+	'valid_years':(3,13),  # 10
+	'grades':(57,83),      # 26 trim definitions (LX2W = 'A')
+})
+decode_record_25 = compile_record_decoder(record_25_widths, {
+	'year':3,              # vehicle_df.year
+	'door':4,              # vehicle_df.doors
+	'area':5,              # vehicle_df.area
+	'transmission':6,      # vehicle_df.trans
+	'origin':7,            # vehicle_df.origin
+	'grade':8,             # vehicle_df.grade
+	'model_serial':9,      # vehicle_df.vin_serial
+	'model_serial_low':10, # vehicle_df.vin_serial_low
+	'model_serial_high':11,# vehicle_df.vin_serial_high
+	'engine_serial':12,    # vehicle_df.eng_serial_type
+	'trans_serial':15,     # vehicle_df.trans_serial_type
+})
+# section and block number sit at the same offsets in header and body rows
+decode_record_30_block = compile_record_decoder(record_30_widths, {
+	'section_id':3,
+	'block_num':4,
+})
+decode_record_30_header = compile_record_decoder(record_30_header_widths, {
+	'block_desc':7,        # illustration_df.name
+	'illustration_id':9,   # illustration_df.id
+})
+decode_record_30 = compile_record_decoder(record_30_widths, {
+	'illustration_ref_num':5,
+	'line_desc':8,
+	'line_desc_cont':9,
+	'years':(10,20),       # 10
+	'transmissions':(20,30), # 10
+	'areas':(30,54),       # 24
+	'serial_num_from':54,  # 55 is a filler
+	'serial_num_to':56,
+	'doors':(57,67),       # 10
+	'grades':(67,93),      # 26
+	'origins':(93,103),    # 10
+	'qty_req':103,
+	'part_num':104,
+})
+
 # Group definitions
 group_definitions = {
 	'01':'ENGINE',
@@ -133,55 +311,145 @@ def get_body_style(door_count):
 
 	return body_style
 
-def get_position_id(position):
-
-	aces_position_id_map = {
-		'FR\.'		:['Front',22],
-		'RR\.'		:['Rear',30],
-		'R\.'		:['Right',12],
-		'L\.'		:['Left',2],
-		'FR\. L\.'	:['Front Left', 103],
-		'RR\. L\.'	:['Rear Left', 105],
-		'FR\. R\.'	:['Front Right', 104],
-		'RR\. R\.'	:['Rear Right', 106],
-	}
-	position_map = None
+aces_position_id_map = [
+	[r'FR\.'		,['Front',22]],
+	[r'RR\.'		,['Rear',30]],
+	[r'R\.'		,['Right',12]],
+	[r'L\.'		,['Left',2]],
+	[r'FR\. L\.'	,['Front Left', 103]],
+	[r'RR\. L\.'	,['Rear Left', 105]],
+	[r'FR\. R\.'	,['Front Right', 104]],
+	[r'RR\. R\.'	,['Rear Right', 106]],
+]
+# compile each position term once, first match wins
+aces_position_id_map = [[re.compile(rf"\b{x[0]}$"), x[1]] for x in aces_position_id_map]
+
+# positions that could not be mapped in the current catalog, with the number of rows using them
+unmapped_positions = collections.Counter()
+
+@functools.lru_cache(maxsize=None)
+def match_position(position):
 	for id_map in aces_position_id_map:
-		if re.match(rf"\b{id_map}$",position):
-			position_map = aces_position_id_map[id_map]
-			break
-	
+		if id_map[0].match(position):
+			return id_map[1]
+	return None
+
+def get_position_id(position, count=1):
+
+	position_map = match_position(position)
 	if position_map == None:
+		# log new position that needs mapped, written with write_position_map_report
+		unmapped_positions[position] += count
+
+	return position_map
+
+def write_position_map_report(catalog_id):
+	# append one json line per unmapped position of the catalog, most used first, and reset the counts
+	if unmapped_positions:
 		date_time = str(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-		log = date_time + ' - position could not be mapped: ' + str(position) + '\n'
-		# log new position that needs mapped
+		log = ''
+		for position, count in unmapped_positions.most_common():
+			log = log + json.dumps({'time':date_time, 'catalog_id':str(catalog_id), 'position':str(position), 'count':count}) + '\n'
 		file_path = temp_raw_dir.resolve().parent / "PositionMapError.txt"
 		file1 = open(file_path, "a+")
 		file1.write(log)
 		file1.close()
+	unmapped_positions.clear()
 
-	return position_map
+@functools.lru_cache(maxsize=None)
+def get_car_id(model, year, trim, engine):
+	# assign string to generate md5 hash
+	car_id_string = str(model) + str(year) + str(trim) + str(engine)
+	# encode the string to bytes with encode(), then return the hash with hexdigest()
+	return hashlib.md5(car_id_string.encode()).hexdigest()
+
+url_separator_regex = re.compile(r"(/)|( +)|(,)|([(])|([)])|(\.)|(')")
+url_dash_regex = re.compile(r"-{2,}")
 
+# the same groups, parts and vehicles are slugged across every catalog, so results are kept for the whole process
+@functools.lru_cache(maxsize=None)
 def URLifyString(string):
 
 	string = string.replace("&","and") # replace ampersand
-	string = re.sub(r"(/)|( +)|(,)|([(])|([)])|(\.)|(')", "-", string)
-	string = re.sub(r"-{2,}", "-", string)
+	string = url_separator_regex.sub("-", string)
+	string = url_dash_regex.sub("-", string)
 	string = string.rstrip("-").lower() # convert string to lowercase
 
 	# string = urlquote(string) # alternate URLify option. does not match current config though
 
 	return string
 
+def URLifyColumn(column):
+	# slug each distinct value of a column once and map the results back
+	return column.map({x:URLifyString(x) for x in column.unique()})
+
 def get_aces_table(make):
 
 	aces_cars = pd.read_sql_query(
-		'''SELECT DISTINCT model, year, trim, engine FROM aces_cars WHERE make = %s ORDER BY model, year, trim, engine''',
-		catalog_engine,
-		params=[make])
+		text('''SELECT DISTINCT model, year, trim, engine FROM aces_cars WHERE make = :make ORDER BY model, year, trim, engine'''),
+		get_catalog_engine(),
+		params={'make':make})
 
 	return aces_cars
 
+def get_aces_db_fingerprint(make):
+	# cheap check for changes to a make's ACES rows
+	fingerprint = pd.read_sql_query(
+		text('''SELECT COUNT(*) AS row_count, COUNT(DISTINCT model) AS model_count, MIN(year) AS min_year, MAX(year) AS max_year FROM aces_cars WHERE make = :make'''),
+		get_catalog_engine(),
+		params={'make':make})
+
+	return [str(x) for x in fingerprint.iloc[0].tolist()]
+
+# snapshots are stored as feather when pyarrow is available
+aces_snapshot_suffix = '.feather' if importlib.util.find_spec('pyarrow') else '.pkl'
+
+def read_aces_snapshot(path):
+	if path.suffix == '.feather':
+		return pd.read_feather(path)
+	return pd.read_pickle(path)
+
+def write_aces_snapshot(aces, path):
+	temp_path = path.with_name(path.name + '.tmp')
+	if path.suffix == '.feather':
+		aces.reset_index(drop=True).to_feather(temp_path)
+	else:
+		aces.to_pickle(temp_path)
+	os.replace(temp_path, path)
+
+def get_aces_snapshot(make):
+	# ACES table for a make, reused from cache_dir/aces while the database fingerprint is unchanged
+	if cache_dir is None:
+		if offline:
+			raise ValueError('--offline requires --cache-dir with ACES snapshots')
+		return get_aces_table(make)
+
+	snapshot_dir = cache_dir / 'aces'
+	meta_path = snapshot_dir / (make + '.json')
+	meta = None
+	if meta_path.is_file():
+		with open(meta_path) as f:
+			meta = json.load(f)
+	snapshot_path = None if meta is None else snapshot_dir / meta['file']
+
+	if offline:
+		if snapshot_path is None or not snapshot_path.is_file():
+			raise FileNotFoundError('No ACES snapshot for ' + make + ' in ' + str(snapshot_dir))
+		return read_aces_snapshot(snapshot_path)
+
+	fingerprint = get_aces_db_fingerprint(make)
+	if not refresh_aces and snapshot_path is not None and meta['fingerprint'] == fingerprint and snapshot_path.is_file():
+		return read_aces_snapshot(snapshot_path)
+
+	aces = get_aces_table(make)
+	snapshot_dir.mkdir(parents=True, exist_ok=True)
+	snapshot_path = snapshot_dir / (make + aces_snapshot_suffix)
+	write_aces_snapshot(aces, snapshot_path)
+	with open(meta_path, 'w') as f:
+		json.dump({'fingerprint':fingerprint, 'file':snapshot_path.name, 'created':datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}, f)
+
+	return aces
+
 def get_illustration_info_table(images):
 
 	# convert list to string for sql injection
@@ -190,324 +458,377 @@ def get_illustration_info_table(images):
 
 	query_string = "SELECT imageID, file_checksum FROM rp_illustration_info WHERE imageID in (" + images + ")"
 
+	# without the database every image is treated as new
+	if offline:
+		return pd.DataFrame(columns=['imageID', 'file_checksum'])
+
 	illustration_info = pd.read_sql_query(
 		query_string,
-		catalog_engine)
+		get_catalog_engine())
 
 	return illustration_info
 
-def validate_aces(_aces, _model, _year, _trim):
-	_model = _model.lower()
-	_trim = _trim.lower()
-	_year = int(_year)
-
-	# set variable for return
-	validated_list = []
-
-	search_string = str(_year) + ' - ' + str(_model) + ' - ' + str(_trim)
-
-	# Pull in aces db for the year
-	aces_table = _aces[(_aces['year'] == _year)]
-	# format AHM models for known differences
-	specific_model_transforms = [
-			# min_year, max_year, trim, model match, model replacement
-			[2010, 2011, '', 'crosstour', 'accord crosstour'],
-			[1984, 1987, '', 'crx', 'civic crx'],
-			[1993, 1997, '', 'del sol', 'civic del sol'],
-			[1969, 1972, '', 'n600', '600'],
-			[1969, 1972, '', 'z600', '600'],
-			[1984, 1987, 'wv', 'civic', 'wagovan']
-	]
-	for transform_list in specific_model_transforms:
-		if _year >= transform_list[0] and _year <= transform_list[1] and not (transform_list[2] or (_trim in transform_list[2])):
-			_model = re.sub(rf"^{transform_list[3]}", transform_list[4], _model)
-	
-	# parse AHM models for trim definitions
-	model = None
-	model_trim = None
-
-	# The model sometimes contains terms that are part of the trim - We will append these to the trim after transforming it
-	model_trims = [
-		'crx',
-		'electric',
-		'ev',
-		'fuel cell',
-		'hybrid',
-		'ngv',
-		'plug-in',
-	]
+# format AHM models for known differences
+specific_model_transforms = [
+		# min_year, max_year, trim, model match, model replacement
+		[2010, 2011, '', 'crosstour', 'accord crosstour'],
+		[1984, 1987, '', 'crx', 'civic crx'],
+		[1993, 1997, '', 'del sol', 'civic del sol'],
+		[1969, 1972, '', 'n600', '600'],
+		[1969, 1972, '', 'z600', '600'],
+		[1984, 1987, 'wv', 'civic', 'wagovan']
+]
+specific_model_transforms = [x[:3] + [re.compile(rf"^{x[3]}"), x[4]] for x in specific_model_transforms]
+
+# The model sometimes contains terms that are part of the trim - We will append these to the trim after transforming it
+model_trims = [
+	'crx',
+	'electric',
+	'ev',
+	'fuel cell',
+	'hybrid',
+	'ngv',
+	'plug-in',
+]
+
+# format AHM trims for known differences
+specific_trim_transforms = [
+	# min_year, max_year, model, trim match, trim replacement
+	[1993, 1993, 'accord', 'anniversary ed\.', '10th anniversary'],
+	[1996, 1996, 'accord', 'anniversary ed\.', '25th anniversary edition'],
+	[2006, 2006, 'accord', 'se', 'lx special edition'],
+	[2017, 2017, 'accord', 'se', 'sport se'],
+	[1975, 1979, 'civic', '1500', 'cvcc'],
+	[1975, 1979, 'civic', '^\*\*$', 'cvcc'],
+	[1980, 1980, 'civic', '^\*\*$', '1500'],
+	[1988, 1991, 'civic', '4wd', 'rt 4wd'],
+	[2001, 2002, 'mdx', 'prem', 'touring'],
+	[1985, 1987, 'prelude', 'si', '2.0 si'],
+	[2014, 2014, 'ridgeline', 'rtl-s', 'se'],
+	[1999, 2004, 'rl', 'rl', 'premium'],
+	[2014, 2014, 'tl', '3\.7', 'sh-awd 3.7'],
+]
+specific_trim_transforms = [x[:3] + [re.compile(x[3]), x[4]] for x in specific_trim_transforms]
+
+# apply generic trim transformations
+trim_transforms = [
+	# Remove 2w,4w,aw,etc and everything after it
+	['2w.*|4w.*|aw.*',''],
+	# Remove single digit in beginning of string if not followed by another number
+	['^(\d{1})(?!\d)',''],
+	# Special characters
+	['a/c',''],
+	['([^0-9])\.', '\\1'],
+	['[()*]', ''],
+	['[\/]', ' '],
+	# Separate/swap terms
+	['([a-zA-Z]+)(v\d)', '\\1 \\2'],        # Separate the engine config
+	['((\d+\.?\d+)?)(([a-zA-Z]+)?)((\d+\.?\d+)?)', '\\3'],  # Separate the engine liter
+	# Hybrid
+	['(.*)phev', 'plug-in hybrid \\1'],
+	['([el]x-?l?|tour(ing)?) hybrid', 'hybrid \\1'],
+	['hybrid( nv)? lea?(ther)?', 'hybrid-l'],
+	['hy-',''],
+	# Special edition
+	['(?<!se )special edition', 'special edition'],
+	['\\b(spec(ia)?l?)(?!\s+edition)\\b', 'special edition'],
+	['\\bed\\b', 'edition'],
+	['\\bse\\b', 'se special edition'],
+	['lssp', 'ls special edition'],
+	# General
+	['-w$',''],
+	['-p$',''],
+	['abs.*',''],
+	['2lnr|4lnr',''],
+	['2.05', '2.1 '],
+	['((dx)-?value|vp)', '\\2 value package'],
+	['dx','dx '],
+	['vp','value package'],
+	['(?<!sh-)awd|shawd', 'sh-awd'],
+	['ex-s','ex s'],
+	['exlnr|ex-ln|exlt|exln|exlres|exlsns|exls|exl', 'ex-l '],
+	['(si)?v-?tec', '\\1 vtec'],
+	['(spt|sprt)', 'sport'],
+	['(hytour|tourin|tourng|tourrn|tourpx|tournv|tourt|toura|tour2|tourv|trg|trng|trn|tour|tr)', 'touring'],
+	['xl2sne|xl4sne','touring'],
+	['black', 'black edition'],
+	['exnav|exres|exsns|exn|exs','ex'],
+	['ex lea?(ther)?', 'ex-l'],
+	['(ex)(.*)(?=turbo)', '\\1-t\\2'],
+	['ex-?l-t', 'ex-l touring'],
+	['ex-t[al]+', 'ex-t'],
+	['exlsul', 'ex-l sul'],
+	['extsns|ext','ex-t'],
+	['gsl', 'gs'],
+	['lx-car|lxsns|lxabs|lx&|lx-c','lx'],
+	['lxs','lx-s'],
+	['lx\+', 'lx-p'],
+	['pre', 'premium'],
+	['rtl ([et])', 'rtl-\\1 '],
+	['rtlsn|rtls','rtl rts'],
+	['rtlt','rtl-t'],
+	['type-r', 'type r'],
+	['r-tour','type r'],
+	['van', 'cargo'],
+	['wv', 'dx'],
+	['elite4','elite'],
+	['typsnv|typs|types','type-s '],
+	['abac',''],
+	['$r',''],
+	['^sport','sport '],
+	['spose','sport se'],
+	['sihptn','si']
+]
+trim_transforms = [[re.compile(x[0]), x[1]] for x in trim_transforms]
+
+# engine liter or engine config terms, and engine cylinder terms in a trim
+engine_term_regex = re.compile(r"(\d\.\d|[lv]\d)", flags=re.IGNORECASE)
+engine_cylinder_regex = re.compile(r"(\d)[ -]?cyl", flags=re.IGNORECASE)
+
+class AcesMatcher:
+	# maps AHM model/year/trim values to ACES vehicles for one make's ACES table.
+	# the table is split by year once, the model match for each (year, model) is indexed on first use,
+	# and results (including mapping errors) are memoized on the normalized model/year/trim
+
+	def __init__(self, aces):
+		self.aces = aces
+		self.aces_by_year = {year:table for year, table in aces.groupby('year')}
+		self.model_index = {}
+		self.trim_regexes = {}
+		self.results = {}
+
+	def match(self, _model, _year, _trim):
+		key = (_model.lower(), int(_year), _trim.lower())
+		if key not in self.results:
+			try:
+				self.results[key] = self.validate(*key)
+			except ValueError as err:
+				self.results[key] = err
+		result = self.results[key]
+		if isinstance(result, ValueError):
+			raise ValueError(str(result))
+		return result
+
+	def get_model_aces(self, _model, _year):
+		# returns (model, valid trims longest first, trim -> engines) for the ACES rows matching any term of the model
+		key = (_year, _model)
+		if key not in self.model_index:
+			# Pull in aces db for the year
+			aces_table = self.aces_by_year.get(_year, self.aces.iloc[0:0])
+			# search all rows containing models matching the terms list
+			aces_table = aces_table[aces_table['model'].str.contains('|'.join(_model.split(" ")),flags=re.IGNORECASE)]
+			if aces_table['model'].empty:
+				self.model_index[key] = None
+			else:
+				model = aces_table['model'].unique()[0]
+				# sort list by length of item
+				valid_trims = sorted(aces_table['trim'].unique(), key=len, reverse=True)
+				trim_engines = {trim:group['engine'].values for trim, group in aces_table.groupby('trim', sort=False)}
+				self.model_index[key] = (model, valid_trims, trim_engines)
+		return self.model_index[key]
+
+	def validate(self, _model, _year, _trim):
+
+		# set variable for return
+		validated_list = []
+
+		search_string = str(_year) + ' - ' + str(_model) + ' - ' + str(_trim)
+
+		for transform_list in specific_model_transforms:
+			if _year >= transform_list[0] and _year <= transform_list[1] and not (transform_list[2] or (_trim in transform_list[2])):
+				_model = transform_list[3].sub(transform_list[4], _model)
+
+		# parse AHM models for trim definitions
+		model_trim = None
+
+		# Match the model to an ACES model
+		# Start with the full model and trim off terms from the end until we find a match
+		temp_model_terms = _model.split(" ")
+
+		# set model
+		model_aces = self.get_model_aces(_model, _year)
+		if model_aces is None:
+			raise ValueError('Could not map ' + search_string +". Model not found in ACES")
+		model, valid_trims, trim_engines = model_aces
+		# if a trim is in the terms list, set variable
+		for trim in temp_model_terms:
+			if trim in model_trims:
+				model_trim = trim
+				break
+
+		for transform_list in specific_trim_transforms:
+			if _year >= transform_list[0] and _year <= transform_list[1] and model == transform_list[2]:
+				_trim = transform_list[3].sub(transform_list[4], _trim)
+
+		# Append any trim term we pulled from the model
+		if model_trim:
+			if not model_trim.lower() in _trim:
+				_trim = model_trim + ' ' + _trim
+		# strip leading and trailing whitespace
+		_trim = _trim.strip()
+
+		for transform in trim_transforms:
+			_trim = transform[0].sub(transform[1], _trim)
+
+		# strip leading and trailing whitespace
+		_trim = _trim.rstrip().lstrip()
+
+		# Match the trim to an ACES trim
+		# Match each ACES trim for the model to the trim we have starting with the longest one
+		# Each term of the ACES trim must be in the trim in order, but not necessarily adjacent
+		trim_list = []
+
+		for valid_trim in valid_trims:
+			if _trim is not None:
+				match = valid_trim.lower()
+				match_regex = self.trim_regexes.get(match)
+				if match_regex is None:
+					match_regex = self.trim_regexes[match] = re.compile(rf"\b{match}\b")
+				# if entire trim matches, add to list and remove from search string
+				if match_regex.match(_trim):
+					trim_list.append(valid_trim)
+					_trim = _trim.replace(match, '')
+				elif match_regex.search(_trim):
+					trim_list.append(valid_trim)
+
+		if not trim_list:
+			if 'Base' in valid_trims:
+				trim_list.append('Base')
+			else:
+				raise ValueError('Could not map ' + search_string + ' missing trim - ' + _trim + ' valid trims: ' + str(valid_trims))
 
-	# Match the model to an ACES model
-	# Start with the full model and trim off terms from the end until we find a match
-	temp_model = _model
-	temp_model_terms = temp_model.split(" ")
+		for trim in trim_list:
+			# parse engines from trims, try to assign specific engines. if not, assign ALL engines found for trim
+			engines = []
+			potential_matches = []
 
-	# search all rows containing models matching the terms list
-	aces_table = aces_table[aces_table['model'].str.contains('|'.join(temp_model_terms),flags=re.IGNORECASE)]
-	# set model
-	if not aces_table['model'].empty:
-		model = aces_table['model'].unique()[0]
-	else:
-		raise ValueError('Could not map ' + search_string +". Model not found in ACES")
-	# if a trim is in the terms list, set variable
-	for trim in temp_model_terms:
-		if trim in model_trims:
-			model_trim = trim
-			break
-
-	# format AHM trims for known differences
-	specific_trim_transforms = [
-		# min_year, max_year, model, trim match, trim replacement
-		[1993, 1993, 'accord', 'anniversary ed\.', '10th anniversary'],
-		[1996, 1996, 'accord', 'anniversary ed\.', '25th anniversary edition'],
-		[2006, 2006, 'accord', 'se', 'lx special edition'],
-		[2017, 2017, 'accord', 'se', 'sport se'],
-		[1975, 1979, 'civic', '1500', 'cvcc'],
-		[1975, 1979, 'civic', '^\*\*$', 'cvcc'],
-		[1980, 1980, 'civic', '^\*\*$', '1500'],
-		[1988, 1991, 'civic', '4wd', 'rt 4wd'],
-		[2001, 2002, 'mdx', 'prem', 'touring'],
-		[1985, 1987, 'prelude', 'si', '2.0 si'],
-		[2014, 2014, 'ridgeline', 'rtl-s', 'se'],
-		[1999, 2004, 'rl', 'rl', 'premium'],
-		[2014, 2014, 'tl', '3\.7', 'sh-awd 3.7'],
-	]
-	
-	for transform_list in specific_trim_transforms:
-		if _year >= transform_list[0] and _year <= transform_list[1] and model == transform_list[2]:
-			_trim = re.sub(rf"{transform_list[3]}", transform_list[4], _trim)
-	
-	# Append any trim term we pulled from the model
-	if model_trim:
-		if not model_trim.lower() in _trim:
-			_trim = model_trim + ' ' + _trim
-	# strip leading and trailing whitespace
-	_trim = _trim.strip()
-
-	# apply generic trim transformations
-	trim_transforms = [
-		# Remove 2w,4w,aw,etc and everything after it
-		['2w.*|4w.*|aw.*',''],
-		# Remove single digit in beginning of string if not followed by another number
-		['^(\d{1})(?!\d)',''],
-		# Special characters
-		['a/c',''],
-		['([^0-9])\.', '\\1'],
-		['[()*]', ''],
-		['[\/]', ' '],
-		# Separate/swap terms
-		['([a-zA-Z]+)(v\d)', '\\1 \\2'],        # Separate the engine config
-		['((\d+\.?\d+)?)(([a-zA-Z]+)?)((\d+\.?\d+)?)', '\\3'],  # Separate the engine liter
-		# Hybrid
-		['(.*)phev', 'plug-in hybrid \\1'],
-		['([el]x-?l?|tour(ing)?) hybrid', 'hybrid \\1'],
-		['hybrid( nv)? lea?(ther)?', 'hybrid-l'],
-		['hy-',''],
-		# Special edition
-		['(?<!se )special edition', 'special edition'],
-		['\\b(spec(ia)?l?)(?!\s+edition)\\b', 'special edition'],
-		['\\bed\\b', 'edition'],
-		['\\bse\\b', 'se special edition'],
-		['lssp', 'ls special edition'],
-		# General
-		['-w$',''],
-		['-p$',''],
-		['abs.*',''],
-		['2lnr|4lnr',''],
-		['2.05', '2.1 '],
-		['((dx)-?value|vp)', '\\2 value package'],
-		['dx','dx '],
-		['vp','value package'],
-		['(?<!sh-)awd|shawd', 'sh-awd'],
-		['ex-s','ex s'],
-		['exlnr|ex-ln|exlt|exln|exlres|exlsns|exls|exl', 'ex-l '],
-		['(si)?v-?tec', '\\1 vtec'],
-		['(spt|sprt)', 'sport'],
-		['(hytour|tourin|tourng|tourrn|tourpx|tournv|tourt|toura|tour2|tourv|trg|trng|trn|tour|tr)', 'touring'],
-		['xl2sne|xl4sne','touring'],
-		['black', 'black edition'],
-		['exnav|exres|exsns|exn|exs','ex'],
-		['ex lea?(ther)?', 'ex-l'],
-		['(ex)(.*)(?=turbo)', '\\1-t\\2'],
-		['ex-?l-t', 'ex-l touring'],
-		['ex-t[al]+', 'ex-t'],
-		['exlsul', 'ex-l sul'],
-		['extsns|ext','ex-t'],
-		['gsl', 'gs'],
-		['lx-car|lxsns|lxabs|lx&|lx-c','lx'],
-		['lxs','lx-s'],
-		['lx\+', 'lx-p'],
-		['pre', 'premium'],
-		['rtl ([et])', 'rtl-\\1 '],
-		['rtlsn|rtls','rtl rts'],
-		['rtlt','rtl-t'],
-		['type-r', 'type r'],
-		['r-tour','type r'],
-		['van', 'cargo'],
-		['wv', 'dx'],
-		['elite4','elite'],
-		['typsnv|typs|types','type-s '],
-		['abac',''],
-		['$r',''],
-		['^sport','sport '],
-		['spose','sport se'],
-		['sihptn','si']
-	]
+			# Get any engine liter or engine config terms from the trim
+			search = engine_term_regex.search(_trim)
+			if search is not None:
+				potential_matches.append(search.group(0))
 
-	for transform in trim_transforms:
-		_trim = re.sub(rf"{transform[0]}", rf"{transform[1]}", _trim)
-	
-	# strip leading and trailing whitespace
-	_trim = _trim.rstrip().lstrip()
-
-	# Match the trim to an ACES trim
-	# Match each ACES trim for the model to the trim we have starting with the longest one
-	# Each term of the ACES trim must be in the trim in order, but not necessarily adjacent
-
-	valid_trims = aces_table['trim'].unique()
-	# sort list by length of item
-	valid_trims = sorted(valid_trims, key=len, reverse=True)
-
-	trim_list = []
-
-	for valid_trim in valid_trims:
-		if _trim is not None:
-			match = valid_trim.lower()
-			match_regex = re.compile(rf"\b{match}\b")
-			# if entire trim matches, add to list and remove from search string
-			if match_regex.match(_trim):
-				trim_list.append(valid_trim)
-				_trim = _trim.replace(match, '')
-			elif match_regex.search(_trim):
-				trim_list.append(valid_trim)
-	
-	if not trim_list:
-		if 'Base' in valid_trims:
-			trim_list.append('Base')
-		else:
-			raise ValueError('Could not map ' + search_string + ' missing trim - ' + _trim + ' valid trims: ' + str(valid_trims))
-
-	for trim in trim_list:
-		# parse engines from trims, try to assign specific engines. if not, assign ALL engines found for trim
-		engines = []
-		potential_matches = []
-
-		# Get any engine liter or engine config terms from the trim
-		search = re.search(r"(\d\.\d|[lv]\d)", _trim, flags=re.IGNORECASE)
-		if search is not None:
-			potential_matches.append(search.group(0))
-
-		# Get any engine cylinder terms from the trim and convert them to an engine config
-		search = re.search(r"(\d)[ -]?cyl", _trim, flags=re.IGNORECASE)
-		if search is not None:
-			potential_matches.append("v"+search.group(0))
-			potential_matches.append("l"+search.group(0))
-
-		# Get all of the ACES engine for this MMYT
-		if trim in [x for x in aces_table['trim'].values]:
-			all_engines = aces_table[aces_table['trim'].isin([trim])]['engine'].values
-		else:
-			all_engines = []
+			# Get any engine cylinder terms from the trim and convert them to an engine config
+			search = engine_cylinder_regex.search(_trim)
+			if search is not None:
+				potential_matches.append("v"+search.group(0))
+				potential_matches.append("l"+search.group(0))
+
+			# Get all of the ACES engine for this MMYT
+			all_engines = trim_engines.get(trim, [])
 
-		# If any of the engines matches what we parsed from the trim, keep it
-		for match in potential_matches:
-			for engine in all_engines:
-				if engine in match:
-					engines.append(engine)
+			# If any of the engines matches what we parsed from the trim, keep it
+			for match in potential_matches:
+				for engine in all_engines:
+					if engine in match:
+						engines.append(engine)
 
-		# If no engines matched, use all the engines
-		if not engines:
-			engines = all_engines
+			# If no engines matched, use all the engines
+			if not engines:
+				engines = all_engines
 
-		validated_list.append([model, _year, trim, [x for x in engines]])
+			validated_list.append([model, _year, trim, [x for x in engines]])
 
-	# Return the ACES UI values
-	return validated_list
+		# Return the ACES UI values
+		return validated_list
+
+def validate_aces(_aces, _model, _year, _trim):
+	# _aces is an AcesMatcher, or an ACES table to build a one-off matcher for
+	if not isinstance(_aces, AcesMatcher):
+		_aces = AcesMatcher(_aces)
+	return _aces.match(_model, _year, _trim)
+
+rp_car_columns = [
+	'make_id',
+	'car_id',
+	'make',
+	'model',
+	'year',
+	'trim',
+	'engine',
+	'url_make',
+	'url_model',
+	'url_trim',
+	'url_engine',
+	'has_parts',
+	'has_accessories',
+	'external_car_ids',
+	'vehicle_class'
+]
+
+# create constants for make_id
+make_ids = {'Honda':2, 'Acura':1}
 
 def create_rp_car(vehicle_df, honda_aces, acura_aces):
 
-	# create empty datarame
-	rp_car = pd.DataFrame(columns=[
-		'make_id',
-		'car_id',
-		'make',
-		'model',
-		'year',
-		'trim',
-		'engine',
-		'url_make',
-		'url_model',
-		'url_trim',
-		'url_engine',
-		'has_parts',
-		'has_accessories',
-		'external_car_ids',
-		'vehicle_class'
-	])
-
-	# process vehicles dataframe
-	aces_validated_df = pd.DataFrame(columns=['car_id', 'make', 'model', 'year', 'trim', 'engine', 'vin'])
-	# loop over available engines from validate_aces function
-	log = ''
-	# create empty container for car_id to vehicle listings
-	vehicle_car_id_dict = {}
-	for index, row in vehicle_df.iterrows():
-		try:
-			if row['make'] == 'Honda':
-				aces_list = validate_aces(honda_aces, row['model'], row['year'], row['trim'])
-				make_id = 2 # create constant for make_id
-			if row['make'] == 'Acura':
-				aces_list = validate_aces(acura_aces, row['model'], row['year'], row['trim'])
-				make_id = 1 # create constant for make_id
-			# if more than one vehicle is returned, duplicate the vehicle to store 2 car_id's
-			if len(aces_list) > 1:
-				vehicle_df = vehicle_df.append(vehicle_df.loc[index])
-				# log vehicles mapped to multiple ACES
-				orig_model = str(row['year']) + ' ' + str(row['model']) + ' ' + str(row['trim'])
-				mapped_models = str([x[2] for x in aces_list])
-				file_path = temp_raw_dir.resolve().parent / "AcesMappedMoreThanOnce.txt"
-				file1 = open(file_path, "a+")
-				file1.write(orig_model + " - mapped to " + mapped_models + "\n")
-				file1.close()
-			for aces in aces_list:
-				model = aces[0]
-				year = aces[1]
-				trim = aces[2]
-				engines = aces[3]
-				for engine in engines:
-					# assign string to generate md5 hash
-					car_id_string = str(model) + str(year) + str(trim) + str(engine)
-					# encode the string to bytes with encode(), then return the hash with hexdigest()
-					car_id = hashlib.md5(car_id_string.encode()).hexdigest()
-					new_row = {'car_id':car_id, 'make':row['make'], 'model':model, 'year':year, 'trim':trim, 'engine':engine, 'vin':row['vin_serial']}
-					aces_validated_df = aces_validated_df.append(new_row, ignore_index=True)
-					# update add car_id to list for assignment
-					if index in vehicle_car_id_dict:
-						vehicle_car_id_dict[index].append(car_id)
-					else:
-						vehicle_car_id_dict[index] = [car_id]
-		except ValueError as err:
-			log = log + str(row['origin']) + ' - ' + str(row['make']) + ' - ' + str(err) + '\n'
+	aces_by_make = {'Honda':honda_aces, 'Acura':acura_aces}
+	key_columns = ['make', 'model', 'year', 'trim']
+
+	# resolve every distinct make/model/year/trim once
+	resolved = {}
+	for key in vehicle_df[key_columns].drop_duplicates().itertuples(index=False, name=None):
+		if key[0] in aces_by_make:
+			try:
+				resolved[key] = validate_aces(aces_by_make[key[0]], key[1], key[2], key[3])
+			except ValueError as err:
+				resolved[key] = err
+	vehicle_results = [resolved.get(key) for key in zip(vehicle_df['make'], vehicle_df['model'], vehicle_df['year'], vehicle_df['trim'])]
 
 	# export logs
+	log = ''
+	for origin, make, result in zip(vehicle_df['origin'], vehicle_df['make'], vehicle_results):
+		if isinstance(result, ValueError):
+			log = log + str(origin) + ' - ' + str(make) + ' - ' + str(result) + '\n'
 	log_file_path = temp_raw_dir.resolve().parent / "AcesMapError.txt"
 	log_file = open(log_file_path, "a+")
 	log_file.write(log)
 	log_file.close()
 
-	# reset index on vehicle_df to provide unique index for duplicated rows
-	vehicle_df = vehicle_df.reset_index()
+	# if more than one vehicle is returned, duplicate the vehicle to store 2 car_id's
+	multiple_mask = [isinstance(x, list) and len(x) > 1 for x in vehicle_results]
+	if any(multiple_mask):
+		# log vehicles mapped to multiple ACES
+		multiple_log = ''
+		for year, model, trim, aces_list in zip(vehicle_df['year'], vehicle_df['model'], vehicle_df['trim'], vehicle_results):
+			if isinstance(aces_list, list) and len(aces_list) > 1:
+				multiple_log = multiple_log + str(year) + ' ' + str(model) + ' ' + str(trim) + " - mapped to " + str([x[2] for x in aces_list]) + "\n"
+		file_path = temp_raw_dir.resolve().parent / "AcesMappedMoreThanOnce.txt"
+		file1 = open(file_path, "a+")
+		file1.write(multiple_log)
+		file1.close()
 
-	# assign car_id's to vehicles
-	for group_name, vehicle_group in vehicle_df.groupby(['index']):
-		# search through vehicle_car_id_dict for matching index
-		try:
-			car_id_list = vehicle_car_id_dict[group_name]
-			for row_count, row in enumerate(vehicle_group.iterrows()):
-				vehicle_df.at[row[0],'car_id'] = str(car_id_list[row_count])
-		# if this fails, there was an ACES mapping error. check the logs
-		except:
+	# one row per ACES engine for every resolved key, numbered in the order car_id's are handed out to a vehicle's rows
+	aces_rows = []
+	for key, aces_list in resolved.items():
+		if isinstance(aces_list, ValueError):
 			continue
+		position = 0
+		for model, year, trim, engines in aces_list:
+			for engine in engines:
+				aces_rows.append(key + (position, get_car_id(model, year, trim, engine), model, year, trim, engine))
+				position += 1
+	aces_rows = pd.DataFrame(aces_rows, columns=key_columns + ['position', 'car_id', 'aces_model', 'aces_year', 'aces_trim', 'engine'], dtype=object)
+
+	# every ACES engine of every vehicle, in vehicle order
+	aces_validated_df = vehicle_df[key_columns + ['vin_serial']].merge(aces_rows, how='left', on=key_columns, sort=False)
+	aces_validated_df = aces_validated_df[aces_validated_df['car_id'].notna()].reset_index(drop=True)
+	aces_validated_df = pd.DataFrame({
+		'car_id':aces_validated_df['car_id'],
+		'make':aces_validated_df['make'],
+		'model':aces_validated_df['aces_model'],
+		'year':aces_validated_df['aces_year'],
+		'trim':aces_validated_df['aces_trim'],
+		'engine':aces_validated_df['engine'],
+		'vin':aces_validated_df['vin_serial']}, dtype=object)
+
+	# reset index on vehicle_df to provide unique index for duplicated rows
+	vehicle_df = pd.concat([vehicle_df, vehicle_df[multiple_mask]]).reset_index()
+
+	# assign car_id's to vehicles. the n-th row of a vehicle gets the n-th car_id of its ACES mapping,
+	# rows without one (mapping errors) keep their car_id
+	vehicle_df['position'] = vehicle_df.groupby('index').cumcount()
+	car_ids = vehicle_df[key_columns + ['position']].merge(aces_rows[key_columns + ['position', 'car_id']], how='left', on=key_columns + ['position'], sort=False)['car_id']
+	vehicle_df['car_id'] = car_ids.where(car_ids.notna(), vehicle_df['car_id']).values
+	vehicle_df = vehicle_df.drop(columns='position')
 
 	# reset index again for further processing groups
 	vehicle_df = vehicle_df.set_index('index')
@@ -516,272 +837,344 @@ def create_rp_car(vehicle_df, honda_aces, acura_aces):
 	aces_validated_df = aces_validated_df.drop_duplicates()
 	# process through and generate the rp_cars df using unique car_id
 	aces_rp_car = aces_validated_df.drop_duplicates('car_id')
-	for index, row in aces_rp_car.iterrows():
-		if row['make'] == 'Honda':
-			make_id = 2 # create constant for make_id
-		if row['make'] == 'Acura':
-			make_id = 1 # create constant for make_id
-
-		new_car = {
-			'make_id':make_id,
-			'car_id':row['car_id'],
-			'make':row['make'],
-			'model':row['model'],
-			'year':row['year'],
-			'trim':row['trim'],
-			'engine':row['engine'],
-			'url_make':URLifyString(row['make']),
-			'url_model':URLifyString(row['model']),
-			'url_trim':URLifyString(row['trim']),
-			'url_engine':URLifyString(row['engine']),
-			'has_parts':0,
-			'has_accessories':0,
-			'external_car_ids':None,
-			'vehicle_class':None
-		}
-
-		rp_car = rp_car.append(new_car, ignore_index=True)
+	rp_car = pd.DataFrame({
+		'make_id':aces_rp_car['make'].map(make_ids).values,
+		'car_id':aces_rp_car['car_id'].values,
+		'make':aces_rp_car['make'].values,
+		'model':aces_rp_car['model'].values,
+		'year':aces_rp_car['year'].values,
+		'trim':aces_rp_car['trim'].values,
+		'engine':aces_rp_car['engine'].values,
+		'url_make':URLifyColumn(aces_rp_car['make']).values,
+		'url_model':URLifyColumn(aces_rp_car['model']).values,
+		'url_trim':URLifyColumn(aces_rp_car['trim']).values,
+		'url_engine':URLifyColumn(aces_rp_car['engine']).values,
+		'has_parts':0,
+		'has_accessories':0,
+		'external_car_ids':None,
+		'vehicle_class':None
+	}, columns=rp_car_columns, dtype=object)
 
 	return rp_car, vehicle_df, aces_validated_df
 
+classification_columns = ['car_id',
+	'part_number_stripped',
+	'part_name',
+	'db_group',
+	'db_subgroup',
+	'footnote',
+	'description',
+	'application',
+	'position',
+	'illustration_code',
+	'art_callout_id',
+	'url_db_group',
+	'url_db_subgroup',
+	'url_part_name',
+	'url_part_number',
+	'mrsp',
+	'quantity',
+	'part_terminology',
+	'catalog_type',
+	'position_id',
+	'url_position',
+	'catalog_subtype']
+
+# part name terms that are mapped to a position
+position_terms = ['FR.','RR.','R.','L.']
+
+def get_position_data(part_name):
+	# position terms found in a part name, e.g. 'RR. L.'
+	return " ".join([x.strip() for x in position_terms if (x in part_name)])
+
+def get_part_description(mpn_stripped, color, comment):
+	# color, comment, superseded by
+	description_elements = []
+	try:
+		if not pd.isna(color):
+			description_elements.append(str(color))
+	except ValueError:
+		print("color error on mpn: " + mpn_stripped)
+	try:
+		if not pd.isna(comment):
+			description_elements.append(str(comment))
+	except ValueError:
+		print("comment error on mpn: " + mpn_stripped)
+	return ", ".join(description_elements)
+
 def create_rp_classifications(vehicle_df, part_df, illustration_part_df, illustration_df):
 
-	# create tuple from dataframe for iterating over
-	illustration_part_df_values = [(a,b,c,d,e,f) for a,b,c,d,e,f in zip(illustration_part_df['car_id'], illustration_part_df['mpn_stripped'], illustration_part_df['illustration_ref_id'], illustration_part_df['illustration_ref_num'], illustration_part_df['qty_req'], illustration_part_df['region'])]
-	# remove duplicates from above list
-	illustration_part_df_values = list(set(illustration_part_df_values))
-	# create empty container for new rows
-	acura_us_parts = []
-	acura_can_parts = []
-	honda_us_parts = []
-	honda_can_parts = []
-	# loop through part_df
-	for index, row in enumerate(illustration_part_df_values):
-
-		# Get records from other dataframes
-		vehicle_record = vehicle_df.loc[[row[0]]] # Provide .loc with a list value and it will always return a dataframe
-		part_record = part_df.loc[row[1]]
-		illustration_record = illustration_df.loc[row[2]]
-
-		for index, vehicle in vehicle_record.iterrows():
-
-			# assign variables for table generation
-			car_id = vehicle.car_id
-			mpn_stripped = row[1]
-			part_name = part_record.part_name
-			db_group = illustration_record.group
-			db_subgroup = illustration_record.subgroup
-			footnote = vehicle.emissions
-			# color, comment, superseded by
-			description_elements = []
-			try:
-				if not pd.isna(part_record.color):
-					description_elements.append(str(part_record.color))
-			except ValueError:
-				print("color error on mpn: " + row[1])
-			try:
-				if not pd.isna(part_record.comment):
-					description_elements.append(str(part_record.comment))
-			except ValueError:
-				print("comment error on mpn: " + row[1])
-			description = ", ".join(description_elements)
-
-			application = None
-
-			position = None
-			position_id = None
-			url_position = None
-			position_list = ['FR.','RR.','R.','L.']
-			position_data = " ".join([x.strip() for x in position_list if (x in part_name)])
-			if position_data:
-				position_map = get_position_id(position_data)
-				if position_map:
-					position = position_map[0]
-					position_id = position_map[1]
-					url_position = URLifyString(position)
-
-			# get position from part_name
-			illustration_code = illustration_record.id
-			art_callout_id = row[3]
-			url_db_group = URLifyString(db_group)
-			url_db_subgroup = URLifyString(db_subgroup)
-			url_part_name = URLifyString(part_name)
-			url_part_number = URLifyString(mpn_stripped)
-			msrp = None
-			quantity = row[4]
-			part_term = None
-			if db_group == 'ACCESSORIES':
-				catalog_type = 'ACCESSORIES'
-				catalog_subtype = 'ACCESSORIES'
-			else:
-				catalog_type = 'PARTS'
-				catalog_subtype = 'PARTS'
-
-			new_part = [
-					car_id,
-					mpn_stripped,
-					part_name,
-					db_group,
-					db_subgroup,
-					footnote,
-					description,
-					application,
-					position,
-					illustration_code,
-					art_callout_id,
-					url_db_group,
-					url_db_subgroup,
-					url_part_name,
-					url_part_number,
-					msrp,
-					quantity,
-					part_term,
-					catalog_type,
-					position_id,
-					url_position,
-					catalog_subtype
-			]
-
-			if str(row[5]).startswith('U'):
-				if vehicle.make == 'Honda':
-					honda_us_parts.append(new_part)
-				if vehicle.make == 'Acura':
-					acura_us_parts.append(new_part)
-			if str(row[5]).startswith('C'):
-				if vehicle.make == 'Honda':
-					honda_can_parts.append(new_part)
-				if vehicle.make == 'Acura':
-					acura_can_parts.append(new_part)
+	# unique fitments. illustration_part_df.car_id is the vehicle_df index, which repeats for vehicles with more than one car_id
+	fitments = illustration_part_df[['car_id','mpn_stripped','illustration_ref_id','illustration_ref_num','qty_req','region']].drop_duplicates()
+	fitments = fitments.rename(columns={'car_id':'vehicle_index'})
+
+	# derive the part columns once per part
+	parts = pd.DataFrame({
+		'part_name':part_df['part_name'],
+		'description':[get_part_description(x, y, z) for x, y, z in zip(part_df.index, part_df['color'], part_df['comment'])],
+		'url_part_name':URLifyColumn(part_df['part_name']),
+		'url_part_number':URLifyColumn(part_df.index.to_series())
+	}, index=part_df.index)
+	parts['position_data'] = parts['part_name'].map({x:get_position_data(x) for x in parts['part_name'].unique()})
+
+	# derive the illustration columns once per illustration
+	illustrations = pd.DataFrame({
+		'illustration_code':illustration_df['id'],
+		'db_group':illustration_df['group'],
+		'db_subgroup':illustration_df['subgroup'],
+		'url_db_group':URLifyColumn(illustration_df['group']),
+		'url_db_subgroup':URLifyColumn(illustration_df['subgroup'])
+	}, index=illustration_df.index)
+
+	# vehicles without an ACES match keep the 'nan' car_id from parsing, exported empty as read_csv used to write it
+	car_ids = vehicle_df['car_id']
+	vehicles = pd.DataFrame({
+		'vehicle_index':vehicle_df.index,
+		'car_id':car_ids.where(car_ids != 'nan', None).values,
+		'make':vehicle_df['make'].values,
+		'footnote':vehicle_df['emissions'].values
+	})
+
+	classification = fitments.merge(vehicles, on='vehicle_index')
+	classification = classification.merge(parts, left_on='mpn_stripped', right_index=True)
+	classification = classification.merge(illustrations, left_on='illustration_ref_id', right_index=True)
+	classification = classification.rename(columns={'mpn_stripped':'part_number_stripped', 'illustration_ref_num':'art_callout_id', 'qty_req':'quantity'})
+	classification['application'] = None
+	classification['mrsp'] = None
+	classification['part_terminology'] = None
+	classification['catalog_type'] = np.where(classification['db_group'] == 'ACCESSORIES', 'ACCESSORIES', 'PARTS')
+	classification['catalog_subtype'] = classification['catalog_type']
+	# map each distinct position once, unmapped positions are counted by the rows using them
+	positions = {}
+	for position_data, count in classification['position_data'].value_counts().items():
+		position_map = get_position_id(position_data, count) if position_data else None
+		positions[position_data] = [position_map[0], position_map[1], URLifyString(position_map[0])] if position_map else [None, None, None]
+	for x, column in enumerate(['position','position_id','url_position']):
+		classification[column] = pd.Series([positions[key][x] for key in classification['position_data']], index=classification.index, dtype=object)
+	# always float, the type missing positions give it. inferring it per frame wrote 106 or 106.0 depending on whether
+	# every row of the frame (or spill bucket) had a position
+	classification['position_id'] = classification['position_id'].astype('float64')
 	# TODO: ask what to do about supersession data and discontinued flag
 
-	classification_columns = ['car_id',
-		'part_number_stripped',
-		'part_name',
-		'db_group',
-		'db_subgroup',
-		'footnote',
-		'description',
-		'application',
-		'position',
-		'illustration_code',
-		'art_callout_id',
-		'url_db_group',
-		'url_db_subgroup',
-		'url_part_name',
-		'url_part_number',
-		'mrsp',
-		'quantity',
-		'part_terminology',
-		'catalog_type',
-		'position_id',
-		'url_position',
-		'catalog_subtype']
-
-	classification_honda_us = pd.DataFrame(honda_us_parts, columns=classification_columns)
-
-	classification_honda_can = pd.DataFrame(honda_can_parts, columns=classification_columns)
-
-	classification_acura_us = pd.DataFrame(acura_us_parts, columns=classification_columns)
-
-	classification_acura_can = pd.DataFrame(acura_can_parts, columns=classification_columns)
+	region = classification['region'].astype(str)
+	us = region.str.startswith('U')
+	can = region.str.startswith('C')
+	honda = classification['make'] == 'Honda'
+	acura = classification['make'] == 'Acura'
+
+	classification = classification[classification_columns]
+	catalog_metrics.count('classification_rows', len(classification))
+	classification_honda_us = classification[us & honda].reset_index(drop=True)
+
+	classification_honda_can = classification[can & honda].reset_index(drop=True)
+
+	classification_acura_us = classification[us & acura].reset_index(drop=True)
+
+	classification_acura_can = classification[can & acura].reset_index(drop=True)
 
 	return classification_honda_us, classification_honda_can, classification_acura_us, classification_acura_can
 
-def create_rp_illustration_info(illustration_df):
-	# create empty dataframe
-	rp_illustration_info = pd.DataFrame(columns=[
-		'ImageID',
-		'width',
-		'height',
-		'source',
-		'orig_width',
-		'orig_height',
-		'part_source',
-		'base_name',
-		'file_checksum',
-		'processed_file_checksum'
-	])
+rp_illustration_info_columns = [
+	'ImageID',
+	'width',
+	'height',
+	'source',
+	'orig_width',
+	'orig_height',
+	'part_source',
+	'base_name',
+	'file_checksum',
+	'processed_file_checksum'
+]
+
+image_manifest_version = 1
+
+def get_image_manifest_path(catalog_id):
+	return cache_dir / 'image' / (str(catalog_id) + '.json')
+
+def load_image_manifest(catalog_id):
+	# {path relative to image_dir: {'size', 'mtime', 'raw_checksum', 'file_checksum'}} of a catalog's last run
+	if cache_dir is None or catalog_id is None:
+		return {}
+	manifest_path = get_image_manifest_path(catalog_id)
+	if manifest_path.is_file():
+		with open(manifest_path) as f:
+			manifest = json.load(f)
+		if manifest.get('version') == image_manifest_version:
+			return manifest['images']
+	return {}
+
+def save_image_manifest(catalog_id, images):
+	if cache_dir is None or catalog_id is None:
+		return
+	manifest_path = get_image_manifest_path(catalog_id)
+	manifest_path.parent.mkdir(parents=True, exist_ok=True)
+	# write to a temp file and rename so a failed run never leaves a partial manifest
+	temp_path = manifest_path.with_suffix('.tmp')
+	with open(temp_path, 'w') as f:
+		json.dump({'version':image_manifest_version, 'images':images}, f)
+	os.replace(temp_path, manifest_path)
+
+def get_image_manifest_key(location):
+	try:
+		return pathlib.Path(location).relative_to(image_dir).as_posix()
+	except ValueError:
+		return str(location)
+
+def get_file_checksum(location, block_size=1024*1024):
+	# md5 of the raw file bytes, read in blocks
+	md5 = hashlib.md5()
+	with open(location, 'rb') as file:
+		for block in iter(lambda: file.read(block_size), b''):
+			md5.update(block)
+	return md5.hexdigest()
+
+def check_illustration(location, manifest_entry):
+	# cheap change detection. returns the manifest entry for the file, its file_checksum (pixel checksum) is None
+	# when the file changed since the entry was recorded
+	stat = os.stat(location)
+	if manifest_entry and manifest_entry['size'] == stat.st_size and manifest_entry['mtime'] == stat.st_mtime_ns:
+		return manifest_entry
+	raw_checksum = get_file_checksum(location)
+	file_checksum = None
+	if manifest_entry and manifest_entry['raw_checksum'] == raw_checksum:
+		file_checksum = manifest_entry['file_checksum']
+	return {'size':stat.st_size, 'mtime':stat.st_mtime_ns, 'raw_checksum':raw_checksum, 'file_checksum':file_checksum}
+
+def render_illustration(image_id, location, make, existing_checksum, output_dir, manifest_entry=None):
+	# worker: render every image size of one illustration into output_dir. returns the rp_illustration_info row,
+	# or None if the image is unchanged since it was last processed, and the image's new manifest entry
+
+	# a file unchanged since the last run keeps its recorded checksum and is not decoded
+	manifest_entry = check_illustration(location, manifest_entry)
+	if manifest_entry['file_checksum'] is not None and manifest_entry['file_checksum'] == existing_checksum:
+		return None, manifest_entry
+
+	with open(location, 'rb') as file:
+		img = Image.open(file)
+		# set file data for resizing
+		image_width, image_height = img.size
+		image_ratio = image_width / image_height
+
+		# calculate checksum of file
+		new_file_checksum = hashlib.md5(img.tobytes()).hexdigest()
+		manifest_entry = dict(manifest_entry, file_checksum=new_file_checksum)
+
+		# If the checksum is the same as the previously processed imageID, skip it
+		if existing_checksum == new_file_checksum:
+			img.close()
+			return None, manifest_entry
+
+		new_illust = None
+		# transform image into multiple sizes, largest first. each size is resized from the previous one
+		# unless that was scaled up from the original
+		source_img = img
+		for size in sorted(image_sizes, key=image_sizes.get, reverse=True):
+			new_width = image_sizes[size]
+			new_size = (new_width,int(round(new_width/image_ratio)))
+			new_img = source_img.resize(new_size, resample=Image.LANCZOS)
+			new_img_checksum = hashlib.md5(new_img.tobytes()).hexdigest()
+			# export new image file to directory
+			# save the image name with the following data, seaprated by underscore, to import into PHP for s3 upload: image_id, image_source, part_source, image_size (width), processed_file_checksum
+			img_name = image_id + '_ahm_ahm_' +  str(image_sizes[size]) + '_' + new_img_checksum +'.png'
+			file_path = output_dir / img_name
+			# Need to convert to RGB since tiff uses CYMK
+			new_img.convert("RGB")
+			new_img.save(str(file_path), format="png")
+
+			if image_sizes[size] == 485:
+				new_illust = {
+					'ImageID':image_id,
+					'file_checksum':new_file_checksum,
+					'processed_file_checksum':new_img_checksum,
+					'width':new_size[0],
+					'height':new_size[1],
+					'orig_width':image_width,
+					'orig_height':image_height,
+					'part_source':make,
+					'base_name':None,
+					'source':10}
+
+			# close the previous rendition once it is no longer the source
+			if source_img is not img:
+				source_img.close()
+			if new_width <= image_width:
+				source_img = new_img
+			else:
+				source_img = img
+				new_img.close()
+		if source_img is not img:
+			source_img.close()
+		# make sure we close the original image
+		img.close()
+
+	return new_illust, manifest_entry
+
+def create_rp_illustration_info(illustration_df, worker_count=None, catalog_id=None):
+
+	if worker_count is None:
+		worker_count = image_workers
 
 	# get image list
 	image_list = [(x, y, z) for x, y, z in zip(illustration_df['id'], illustration_df['location'], illustration_df['make'])]
 	image_id_list = [x[0] for x in image_list]
 
-	# get existing image checksums
+	# get existing image checksums, the first record of each imageID
 	existing_images = get_illustration_info_table(image_id_list)
+	existing_checksums = existing_images.drop_duplicates('imageID').set_index('imageID')['file_checksum'].to_dict()
+	# size, mtime and checksums of the catalog's images from the last run
+	image_manifest = load_image_manifest(catalog_id)
+	manifest_keys = [get_image_manifest_key(x[1]) for x in image_list]
+
+	render_args = [
+		[x[0] for x in image_list],
+		[x[1] for x in image_list],
+		[x[2] for x in image_list],
+		[existing_checksums.get(x[0]) for x in image_list],
+		[processed_image_dir] * len(image_list),
+		[image_manifest.get(x) for x in manifest_keys]]
+	if worker_count > 1 and len(image_list) > 1:
+		with ProcessPoolExecutor(max_workers=worker_count) as executor:
+			results = list(executor.map(render_illustration, *render_args))
+	else:
+		results = list(map(render_illustration, *render_args))
 
-	# loop through images
-	for image in image_list:
-
-		with open(image[1], 'rb') as file:
-			img = Image.open(file)
-			# set file data for resizing
-			image_width, image_height = img.size
-			image_ratio = image_width / image_height
-
-			# calculate checksum of file
-			new_file_checksum = hashlib.md5(img.tobytes()).hexdigest()
-
-			# If the checksum is the same as the previously processed imageID, skip it
-			image_record = existing_images.loc[existing_images['imageID'] == image[0]]
-			# if results returned
-			if not image_record.empty:
-				# grab the first row in the dataframe
-				if image_record.iloc[0].file_checksum == new_file_checksum:
-					continue
-
-			# transform image into multiple sizes if file checksum is different
-			for size in image_sizes:
-				new_width = image_sizes[size]
-				new_size = (new_width,int(round(new_width/image_ratio)))
-				new_img = img.resize(new_size, resample=Image.LANCZOS)
-				new_img_checksum = hashlib.md5(new_img.tobytes()).hexdigest()
-				# export new image file to directory
-				# save the image name with the following data, seaprated by underscore, to import into PHP for s3 upload: image_id, image_source, part_source, image_size (width), processed_file_checksum
-				img_name = image[0] + '_ahm_ahm_' +  str(image_sizes[size]) + '_' + new_img_checksum +'.png'
-				file_path = processed_image_dir / img_name
-				# Need to convert to RGB since tiff uses CYMK
-				new_img.convert("RGB")
-				new_img.save(str(file_path), format="png")
-
-				if image_sizes[size] == 485:
-					new_illust = {
-						'ImageID':image[0],
-						'file_checksum':new_file_checksum,
-						'processed_file_checksum':new_img_checksum,
-						'width':new_size[0],
-						'height':new_size[1],
-						'orig_width':image_width,
-						'orig_height':image_height,
-						'part_source':image[2],
-						'base_name':None,
-						'source':10}
-					rp_illustration_info = rp_illustration_info.append(new_illust, ignore_index=True)
-
-				# close new image
-				new_img.close()
-			# make sure we close the original image
-			img.close()
-		file.close()
+	save_image_manifest(catalog_id, {key:result[1] for key, result in zip(manifest_keys, results)})
+	catalog_metrics.count('images_rendered', sum(1 for x in results if x[0] is not None))
+	catalog_metrics.count('images_skipped', sum(1 for x in results if x[0] is None))
+	rp_illustration_info = pd.DataFrame([x[0] for x in results if x[0] is not None], columns=rp_illustration_info_columns)
 
 	return rp_illustration_info
 
-def create_rp_vin_masks(aces_validated_df):
-
-	# create empty dataframe
-	rp_vin_masks = pd.DataFrame(columns=[
-		'vin_type',
-		'vin_mask',
-		'car_id'
-	])
-
-	# pull the 2 columns we need from the dataframe using list comprehesion (faster than looping over the dataframe)
-	vehicle_vin_list = [(x, y) for x, y in zip(aces_validated_df['car_id'], aces_validated_df['vin'])]
+rp_vin_mask_columns = ['vin_type', 'vin_mask', 'car_id']
 
-	for vehicle in vehicle_vin_list:
-		new_vin_mask = {'vin_type':'2', 'vin_mask':vehicle[1], 'car_id':vehicle[0]}
-		rp_vin_masks = rp_vin_masks.append(new_vin_mask, ignore_index=True)
+def create_rp_vin_masks(aces_validated_df):
 
-	return rp_vin_masks
+	# one vin mask per validated vehicle
+	return pd.DataFrame({
+		'vin_type':'2',
+		'vin_mask':aces_validated_df['vin'].values,
+		'car_id':aces_validated_df['car_id'].values
+	}, columns=rp_vin_mask_columns, dtype=object)
+
+def export_rp_vin_masks(catalog_id, aces_validated_df, chunk_size=100000):
+	# write the vin masks to the catalog export chunk by chunk instead of building them in one frame
+	table_writer = get_table_writer()
+	with table_writer.stream(processed_dir / (str(catalog_id) + '_rp_vin_masks' + table_writer.extension), rp_vin_mask_columns) as append:
+		for start in range(0, len(aces_validated_df), chunk_size):
+			append(create_rp_vin_masks(aces_validated_df.iloc[start:start + chunk_size]))
+
+def get_car_flags(class_all):
+	# one pass over the classifications: does each car_id have accessory rows, part rows
+	is_accessory = (class_all['db_group'] == 'ACCESSORIES').values
+	return pd.DataFrame({'car_id':class_all['car_id'].values, 'has_accessories':is_accessory, 'has_parts':~is_accessory}).groupby('car_id').any()
+
+def apply_car_flags(rp_car, car_flags):
+	# flags are only ever set, cars without classifications keep their values
+	for column in ['has_accessories', 'has_parts']:
+		flag = rp_car['car_id'].map(car_flags[column]).fillna(False).astype(bool)
+		rp_car.loc[flag.values, column] = 1
+	return rp_car
 
 def process_rp_car(rp_car, class_honda_us, class_honda_can, class_acura_us, class_acura_can):
 
@@ -789,26 +1182,311 @@ def process_rp_car(rp_car, class_honda_us, class_honda_can, class_acura_us, clas
 	class_list = [class_honda_us, class_honda_can, class_acura_us, class_acura_can]
 	class_all = pd.concat(class_list)
 
-	for car in rp_car['car_id']:
-		# search car_id in classification tables for US fitments
-		if car in class_all['car_id'].values:
-			# search for rows with this car_id and a db_group that has "accessories"
-			if not class_all[(class_all['db_group'] == 'ACCESSORIES') & (class_all['car_id'] == car)].empty:
-				rp_car.loc[rp_car['car_id'] == car, 'has_accessories'] = 1
-			if not class_all[(class_all['db_group'] != 'ACCESSORIES') & (class_all['car_id'] == car)].empty:
-				rp_car.loc[rp_car['car_id'] == car, 'has_parts'] = 1
-	return rp_car
-
-def parse_raw_ahm_catalog(file):
+	return apply_car_flags(rp_car, get_car_flags(class_all))
+
+# classification export of each table returned by create_rp_classifications, without the extension
+classification_file_suffixes = [
+	'_classification_honda',
+	'_classification_honda_ca',
+	'_classification_acura',
+	'_classification_acura_ca',
+]
+
+def export_spilled_classifications(catalog_id, vehicle_df, part_df, illustration_parts, illustration_df):
+	# classify a spilled catalog one bucket at a time, appending to the classification exports.
+	# returns the has_parts/has_accessories flags of every car_id for process_rp_car
+	table_writer = get_table_writer()
+	class_paths = [processed_dir / (str(catalog_id) + x + table_writer.extension) for x in classification_file_suffixes]
+	car_flags = []
+	try:
+		with contextlib.ExitStack() as stack:
+			class_streams = [stack.enter_context(table_writer.stream(x, classification_columns)) for x in class_paths]
+			for illustration_part_chunk in illustration_parts.iter_buckets():
+				# deduplicated rows, the same count parse_raw_ahm_catalog takes for a catalog held in memory
+				catalog_metrics.count('fitment_rows', len(illustration_part_chunk))
+				classifications = create_rp_classifications(vehicle_df, part_df, illustration_part_chunk, illustration_df)
+				for append, classification in zip(class_streams, classifications):
+					append(classification)
+				car_flags.append(get_car_flags(pd.concat(classifications)))
+	except BaseException:
+		# never leave a partial catalog for combine_final_dataframes, not even when the run is interrupted
+		for path in class_paths:
+			if path.exists():
+				path.unlink()
+		raise
+
+	if not car_flags:
+		return pd.DataFrame(columns=['has_accessories', 'has_parts'], dtype=bool)
+	return pd.concat(car_flags).groupby(level=0).any()
+
+class IndexedCatalog:
+	# a catalog stored as [offset, length] runs of the raw AHM file (see MergeEPC --output=index)
+
+	def __init__(self, raw_file, catalog_id, runs):
+		self.raw_file = raw_file
+		self.catalog_id = catalog_id
+		self.runs = runs
+
+	@contextlib.contextmanager
+	def open(self):
+		with open(self.raw_file, 'rb') as source, mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			rows = self.iter_rows(mm)
+			try:
+				yield rows
+			finally:
+				# release the memoryview on the map before it is closed
+				rows.close()
+
+	def iter_rows(self, mm):
+		with memoryview(mm) as view:
+			for offset, length in self.runs:
+				# decode straight from the mapped slice, the same way MergeEPC reads the raw file
+				yield from io.StringIO(str(view[offset:offset+length], 'latin-1'), newline=None)
+
+def get_catalog_sources():
+	# yield (catalog_id, source) for every catalog, source is a file path or an IndexedCatalog
+	if catalog_index_file is not None:
+		with open(catalog_index_file) as f:
+			catalog_index = json.load(f)
+		for catalog_id, runs in catalog_index['catalogs'].items():
+			yield catalog_id, IndexedCatalog(catalog_index['raw_file'], catalog_id, runs)
+	else:
+		for path in temp_raw_dir.iterdir():
+			if path.is_file() and path.suffix == '.txt':
+				yield path.stem, path
+
+def open_catalog(source):
+	# open a catalog file or IndexedCatalog for row iteration
+	if isinstance(source, IndexedCatalog):
+		return source.open()
+	return open(source)
+
+# bump when a change to the pipeline invalidates previously cached catalog outputs
+catalog_manifest_version = 4
+
+# per catalog outputs that can be reused when a catalog is unchanged, without the extension of the export format
+catalog_output_suffixes = [
+	'_rp_car',
+	'_classification_honda',
+	'_classification_honda_ca',
+	'_classification_acura',
+	'_classification_acura_ca',
+	'_rp_vin_masks',
+]
+
+def get_catalog_hash(catalog_name, source):
+	# hash the decoded rows so the value is the same for catalog files and indexed catalogs
+	md5 = hashlib.md5()
+	with open_catalog(source) as catalog_file:
+		for row in catalog_file:
+			md5.update(row.encode())
+	# a reused catalog never renders its images, so a replaced illustration has to change the hash too. size and mtime
+	# are the same cheap check the image manifest uses
+	illust_dir = image_dir / catalog_name.lower() / 'illust'
+	if illust_dir.is_dir():
+		for path in sorted(illust_dir.iterdir()):
+			stat = path.stat()
+			md5.update(('%s %d %d\n' % (path.name, stat.st_size, stat.st_mtime_ns)).encode())
+	return md5.hexdigest()
+
+def get_aces_fingerprint(*aces_tables):
+	# catalogs must be re-mapped whenever the ACES data changes
+	md5 = hashlib.md5()
+	for aces in aces_tables:
+		md5.update(pd.util.hash_pandas_object(aces, index=False).values.tobytes())
+	return md5.hexdigest()
+
+def load_catalog_manifest():
+	if cache_dir is None:
+		return None
+	manifest_path = cache_dir / 'epc/manifest.json'
+	if manifest_path.is_file():
+		with open(manifest_path) as f:
+			manifest = json.load(f)
+		if manifest.get('version') == catalog_manifest_version:
+			return manifest
+	return {'version':catalog_manifest_version, 'catalogs':{}}
+
+def save_catalog_manifest(manifest):
+	if manifest is None:
+		return
+	manifest_path = cache_dir / 'epc/manifest.json'
+	manifest_path.parent.mkdir(parents=True, exist_ok=True)
+	# write to a temp file and rename so a failed run never leaves a partial manifest
+	temp_path = manifest_path.with_suffix('.tmp')
+	with open(temp_path, 'w') as f:
+		json.dump(manifest, f)
+	os.replace(temp_path, manifest_path)
+
+def restore_catalog_outputs(manifest, catalog_name, catalog_hash, aces_fingerprint):
+	# copy the cached outputs of an unchanged catalog into processed_dir. returns False if the catalog needs processing
+	if manifest is None:
+		return False
+	entry = manifest['catalogs'].get(catalog_name)
+	if entry is None or entry['hash'] != catalog_hash or entry['aces'] != aces_fingerprint or entry.get('format', 'csv') != export_format:
+		return False
+	cached_paths = [cache_dir / 'epc/outputs' / x for x in entry['outputs']]
+	if not all(x.is_file() for x in cached_paths):
+		return False
+	for path in cached_paths:
+		shutil.copyfile(path, processed_dir / path.name)
+	return True
+
+def remove_catalog_outputs(catalog_id):
+	# delete whatever a failed catalog already exported so combine_final_dataframes never merges part of it
+	extension = get_table_writer().extension
+	paths = [processed_dir / (str(catalog_id) + x + extension) for x in catalog_output_suffixes]
+	paths.append(processed_illustrations_dir / (str(catalog_id) + '_rp_illustration_info' + extension))
+	for path in paths:
+		if path.exists():
+			path.unlink()
 
-	# create empty dataframes
-	catalog_df = pd.DataFrame(columns=['id','desc','manufacturer'])
-	illustration_df = pd.DataFrame(columns=['id','ref_id','make','group','subgroup','location'])
-	vehicle_df = pd.DataFrame(columns=['car_id','make','model','year','trans','doors','emissions','trim','origin','vin_serial','vin_serial_from','vin_serial_to','eng_serial_type','trans_serial_type'])
-	part_df = pd.DataFrame(columns=['mpn_stripped','mpn','manufacturer','part_name', 'color', 'comment','superseded_by','discontinued'])
+def store_catalog_outputs(manifest, catalog_name, catalog_hash, aces_fingerprint, catalog_id=None):
+	# copy a processed catalog's outputs to the cache and record them. catalog_id is None when there was nothing to export
+	if manifest is None:
+		return
+	outputs = []
+	if catalog_id is not None:
+		output_dir = cache_dir / 'epc/outputs'
+		output_dir.mkdir(parents=True, exist_ok=True)
+		for suffix in catalog_output_suffixes:
+			path = processed_dir / (str(catalog_id) + suffix + get_table_writer().extension)
+			shutil.copyfile(path, output_dir / path.name)
+			outputs.append(path.name)
+	manifest['catalogs'][catalog_name] = {'hash':catalog_hash, 'aces':aces_fingerprint, 'format':export_format, 'outputs':outputs}
+
+# origins for north american markets (usa, can)
+north_america_origin = re.compile(r"(U|C)", flags=re.IGNORECASE)
+
+def get_model_year(valid_years, year):
+	# expand a two digit year using the catalog's valid years
+	year = int([x for x in valid_years if x.endswith(year)][0])
+	if year <= 40: # this should be the number where you think it stops to be 20xx (like 15 for 2015; for every number after that it will be 19xx)
+		return year + 2000
+	return year + 1900
+
+illustration_part_columns = ['mpn_stripped','illustration_ref_id','illustration_ref_num','car_id','qty_req','vin_serial_from','vin_serial_to','region']
+
+# vehicle columns matched by a fitment, in the order the option lists are expanded (year outermost, origin innermost)
+fitment_key_columns = ['year','trans','emissions','doors','trim','origin']
+
+def get_vehicle_table(vehicle_index):
+	# vehicle_index as a dataframe of fitment keys and the vehicle index they resolve to
+	vehicle_table = pd.DataFrame(list(vehicle_index), columns=['make','model','year','doors','trans','emissions','trim','origin'], dtype=object)
+	vehicle_table['car_id'] = list(vehicle_index.values())
+	return vehicle_table
+
+def expand_fitments(fitment_rows, vehicle_table):
+	# cross join each row's option lists and join the result to the vehicle table in one merge.
+	# rows are [mpn_stripped, ref_id, ref_num, qty_req, serial_from, serial_to, make, model, years, transmissions, areas, doors, grades, origins]
+	if not fitment_rows:
+		return pd.DataFrame(columns=illustration_part_columns)
+
+	scalars = [[] for x in range(8)]
+	options = [[] for x in fitment_key_columns]
+	counts = []
+	for row in fitment_rows:
+		option_lists = row[8:]
+		lengths = [len(x) for x in option_lists]
+		# every combination of option positions, last option varying fastest like the nested loops it replaces
+		positions = np.indices(lengths).reshape(len(lengths), -1)
+		for column, option_list, position in zip(options, option_lists, positions):
+			column.append(np.array(option_list, dtype=object)[position])
+		counts.append(positions.shape[1])
+		for column, value in zip(scalars, row[:8]):
+			column.append(value)
+
+	fitments = pd.DataFrame({name:np.concatenate(column) for name, column in zip(fitment_key_columns, options)})
+	for name, column in zip(['mpn_stripped','illustration_ref_id','illustration_ref_num','qty_req','vin_serial_from','vin_serial_to','make','model'], scalars):
+		fitments[name] = np.repeat(np.array(column, dtype=object), counts)
+
+	fitments = fitments.merge(vehicle_table, how='left', on=['make','model'] + fitment_key_columns, validate='many_to_one')
+	if fitments['car_id'].isna().any():
+		missing = fitments.loc[fitments['car_id'].isna(), ['make','model'] + fitment_key_columns].iloc[0]
+		raise KeyError('No vehicle found for fitment ' + str(tuple(missing)))
+	fitments['car_id'] = fitments['car_id'].astype('int64')
+	fitments['region'] = fitments['origin']
+
+	return fitments[illustration_part_columns]
+
+class IllustrationPartSpill:
+	# illustration part rows of one catalog, spilled to bucket files in spill_dir instead of held in memory.
+	# rows are bucketed by illustration_ref_id, so duplicates always share a bucket and each bucket is deduplicated on its own
+
+	def __init__(self, spill_dir, bucket_count, buffer_rows=500000):
+		self.spill_dir = spill_dir
+		self.bucket_count = bucket_count
+		self.buffer_rows = buffer_rows
+		if spill_dir.exists():
+			shutil.rmtree(str(spill_dir))
+		spill_dir.mkdir(parents=True)
+		self.buffers = [[] for x in range(bucket_count)]
+		self.buffered = 0
+		self.rows = 0
+		# every mpn_stripped with illustration parts, to clean up part_df
+		self.mpns = set()
+
+	def get_bucket_path(self, bucket):
+		return self.spill_dir / ('bucket_%d.pkl' % bucket)
+
+	def append(self, illustration_parts):
+		# buffer a frame of illustration parts, writing the buffers out once they hold buffer_rows rows
+		buckets = illustration_parts['illustration_ref_id'].map(lambda x: zlib.crc32(str(x).encode()) % self.bucket_count)
+		for bucket, frame in illustration_parts.groupby(buckets.values):
+			self.buffers[bucket].append(frame)
+		self.mpns.update(illustration_parts['mpn_stripped'].unique())
+		self.buffered += len(illustration_parts)
+		self.rows += len(illustration_parts)
+		if self.buffered >= self.buffer_rows:
+			self.flush()
+
+	def flush(self):
+		# each flush appends one pickled frame to every bucket file with buffered rows
+		for bucket, frames in enumerate(self.buffers):
+			if frames:
+				with open(self.get_bucket_path(bucket), 'ab') as f:
+					pickle.dump(pd.concat(frames, ignore_index=True), f, protocol=pickle.HIGHEST_PROTOCOL)
+				self.buffers[bucket] = []
+		self.buffered = 0
+
+	def iter_buckets(self):
+		# yield the deduplicated illustration parts of each bucket
+		self.flush()
+		for bucket in range(self.bucket_count):
+			path = self.get_bucket_path(bucket)
+			if not path.is_file():
+				continue
+			frames = []
+			with open(path, 'rb') as f:
+				while True:
+					try:
+						frames.append(pickle.load(f))
+					except EOFError:
+						break
+			yield pd.concat(frames, ignore_index=True).drop_duplicates().dropna(how='all',axis=0)
+
+	def remove(self):
+		shutil.rmtree(str(self.spill_dir), ignore_errors=True)
+
+def parse_raw_ahm_catalog(file, illustration_part_spill=None):
+
+	# dataframe columns. rows are collected in lists and each dataframe is built once at the end
+	catalog_columns = ['id','desc','manufacturer']
+	illustration_columns = ['id','ref_id','make','group','subgroup','location']
+	vehicle_columns = ['car_id','make','model','year','trans','doors','emissions','trim','origin','vin_serial','vin_serial_from','vin_serial_to','eng_serial_type','trans_serial_type']
+	part_columns = ['mpn_stripped','mpn','manufacturer','part_name', 'color', 'comment','superseded_by','discontinued']
+	# with illustration_part_spill, expanded illustration parts are spilled to its bucket files and it is returned as illustration_part_df
+	catalog_rows = []
+	illustration_rows = []
+	vehicle_rows = []
+	# (make, model, year, doors, trans, emissions, trim, origin) -> index of the first matching vehicle
+	vehicle_index = {}
+	# part registry: mpn_stripped -> part record, plus every raw mpn already seen
+	parts = {}
+	part_mpns = set()
 
 	# Source file
-	with open(file) as catalog_file:
+	with open_catalog(file) as catalog_file:
 		# global variables for line-down file processing
 		record_30_block_num = None
 		# record_30_ref_no = None
@@ -817,33 +1495,35 @@ def parse_raw_ahm_catalog(file):
 		part_comment = None
 		part_super = None
 		grade_definitions = {}
-		new_illustration_part_list = []
+		# fitment rows of the current illustration block, expanded into illustration_part_frames when the block ends.
+		# a spill takes the expanded frames in place of the list
+		fitment_rows = []
+		illustration_part_frames = [] if illustration_part_spill is None else illustration_part_spill
+		vehicle_table = None
+		# rows read per record type
+		record_counts = collections.Counter()
 		# iterate through rows in source file
 		for row in catalog_file:
 			# print(row)
 			# get record type
 			row_type = row[11:13]
+			record_counts[row_type] += 1
 			row_catalog_id = row[3:11].rstrip()
 			# filter data definitions based on row type and apply slices, exporting new row to destination file
 			if row_type == '10':
-				fields = [row[slice].rstrip() for slice in generate_slices(record_10_widths)]
-				row_catalog_id = fields[1]      # catalog_df.catalog_id
-				catalog_name = fields[3]    # catalog_df.catalog_desc, vehicle_df.model (after stripping year info)
-				product_div = fields[4]     # catalog_df.division, vehicle_df.make (A = Honda, B = Acura)
+				row_catalog_id, catalog_name, product_div = decode_record_10(row)
 				if product_div == 'A':
 					vehicle_make = 'Honda'
 				elif product_div == 'B':
 					vehicle_make = 'Acura'
 				else:
 					vehicle_make = None
-				print(vehicle_make)
-				print(catalog_name)
 				if vehicle_make != 'Acura':
 					raise ValueError('This is not an Acura Catalog')
 				vehicle_model = catalog_name.split("'", 1)[0].replace('4D','').replace('5D','').replace('3D','').replace('/','').rstrip()
 				# catalog_df dataframe
 				new_catalog = {'id':row_catalog_id, 'desc':catalog_name, 'manufacturer':vehicle_make}
-				catalog_df = catalog_df.append(new_catalog, ignore_index=True)
+				catalog_rows.append(new_catalog)
 				# print(catalog_name)
 			# elif row_type == '15': # Do not need
 			# 	fields = [row[slice].rstrip() for slice in generate_slices(record_15_widths)]
@@ -851,18 +1531,7 @@ def parse_raw_ahm_catalog(file):
 				# color_desc = fields[4]  # color_info.color_desc
 			# process row 20 for grade definitions (LX2W = 'A')
 			elif row_type == '20':
-				fields = [row[slice].rstrip() for slice in generate_slices(record_20_widths)]
-				# valid years
-				valid_years = []
-				for x in range(3,13): # 5
-					valid_years.append(fields[x])
-				valid_years = [x for x in valid_years if x]
-				# print(valid_years)
-				# trim definitions
-				grades = []
-				for x in range(57,83): # 5
-					grades.append(fields[x])
-				grades = [x for x in grades if x]
+				valid_years, grades = decode_record_20(row)
 				# assign grade definitions
 				for grade in grades:
 					definition = grade[6].rstrip()
@@ -873,112 +1542,45 @@ def parse_raw_ahm_catalog(file):
 					else:
 						grade_definitions[definition] = grade
 			elif row_type == '25':
-				fields = [row[slice].rstrip() for slice in generate_slices(record_25_widths)]
-				year = int([x for x in valid_years if x.endswith(fields[3])][0])                # vehicle_df.year
-				if year <= 40: # this should be the number where you think it stops to be 20xx (like 15 for 2015; for every number after that it will be 19xx)
-					year = year + 2000
-				else:
-					year = year + 1900
-				door = fields[4]                # vehicle_df.doors
-				area = fields[5]                # vehicle_df.area
-				transmission = fields[6]        # vehicle_df.trans
-				origin = fields[7]              # vehicle_df.origin
-				grade = fields[8].replace('*','').replace('$','').replace('#','').replace('?','').replace('%','') # vehicle_df.grade
-				model_serial = fields[9]        # vehicle_df.vin_serial
-				model_serial_low = fields[10]   # vehicle_df.vin_serial_low
-				model_serial_high = fields[11]  # vehicle_df.vin_serial_high
-				engine_serial = fields[12]      # vehicle_df.eng_serial_type
-				# engine_serial_low = fields[13]  # vehicle_df.eng_serial_low
-				# engine_serial_high = fields[14] # vehicle_df.eng_serial_high
-				trans_serial = fields[15]       # vehicle_df.trans_serial_type
-				# trans_serial_low = fields[16]   # vehicle_df.trans_serial_low
-				# trans_serial_high = fields[17]  # vehicle_df.trans_serial_high
+				year, door, area, transmission, origin, grade, model_serial, model_serial_low, model_serial_high, engine_serial, trans_serial = decode_record_25(row)
+				year = get_model_year(valid_years, year) # vehicle_df.year
+				grade = grade.replace('*','').replace('$','').replace('#','').replace('?','').replace('%','') # vehicle_df.grade
 				# vehicle dataframe
 				# grab everything that begins with U or C for north american markets (usa, can)
-				search = re.search(r"(U|C)", origin, flags=re.IGNORECASE)
-				if search is not None:
+				if north_america_origin.search(origin):
+					vehicle_index.setdefault((vehicle_make, vehicle_model, year, door, transmission, area, grade, origin), len(vehicle_rows))
 					new_vehicle = {'make':vehicle_make,'model':vehicle_model,'year':year,'trans':transmission,'doors':door,'emissions':area,'trim':grade,'origin':origin,'vin_serial':model_serial,'vin_serial_from':model_serial_low,'vin_serial_to':model_serial_high,'eng_serial_type':engine_serial,'trans_serial_type':trans_serial}
-					vehicle_df = vehicle_df.append(new_vehicle, ignore_index=True)
+					vehicle_rows.append(new_vehicle)
 			elif row_type == '30':
-				fields = [row[slice].rstrip() for slice in generate_slices(record_30_widths)]
-				section_id = fields[3]
-				block_num = fields[4]
+				section_id, block_num = decode_record_30_block(row)
 				# check if new block
 				if block_num != record_30_block_num:
-					fields = [row[slice].rstrip() for slice in generate_slices(record_30_header_widths)]
+					# expand the fitments of the block that just ended
+					if fitment_rows:
+						if vehicle_table is None or len(vehicle_table) != len(vehicle_index):
+							vehicle_table = get_vehicle_table(vehicle_index)
+						illustration_part_frames.append(expand_fitments(fitment_rows, vehicle_table))
+						fitment_rows = []
+					block_desc, illustration_id = decode_record_30_header(row)
 					# process header record
 					record_30_block_num = block_num     # illustration_df.ref_id
-					# block_seq = fields[5]
-					# block_pre_id = fields[6]
-					block_desc = fields[7]              # illustration_df.name
-					print(block_desc)
-					# block_suf_id = fields[8]
-					illustration_id = fields[9].split(' ')[0]         # illustration_df.id
+					illustration_id = illustration_id.split(' ')[0]         # illustration_df.id
 					# if 13 chracters, strip last character for check character
 					if len(illustration_id) == 13:
 						illustration_id = illustration_id[:-1]
-					# catalog_block_num_2 = fields[10]
-					# catalog_section_id = fields[11]
-					# catalog_block_chart_id = fields[12]
 					# illustration_df.location is generated from catalog_df.id and illustration_df.id
 					illustration_location = str(image_dir) + '/' + str(row_catalog_id).lower() + '/illust/' + illustration_id + '.tif' # illustration_df.location
 					# illustrations dataframe entry
 					if record_30_block_num != None:
 						new_illustration = {'id':illustration_id,'ref_id':record_30_block_num,'make':vehicle_make,'group':group_definitions[section_id],'subgroup':block_desc,'location':illustration_location}
-						illustration_df = illustration_df.append(new_illustration, ignore_index=True)
+						illustration_rows.append(new_illustration)
 					# print(block_desc)
 				# if record in existing block
 				elif block_num == record_30_block_num:
 					# process body record into variables
-					illustration_ref_num = fields[5] # block
-					# illustration_ref_num_ext = fields[6] # not used in file
-					# illustration_row_seq = fields[7] # block items
-					line_desc = fields[8].replace('(','').replace(')','')
-					line_desc_cont = fields[9]
-
-					years_1_5 = []
-					for x in range(10,15): # 5
-						years_1_5.append(fields[x])
-					years_1_5 = [x for x in years_1_5 if x]
-
-					years_6_10 = []
-					for x in range(15,20): # 5
-						years_6_10.append(fields[x])
-					years_6_10 = [x for x in years_6_10 if x]
-
-					years = years_1_5 + years_6_10
-
-					transmissions = []
-					for x in range(20,30): # 10
-						transmissions.append(fields[x])
-					transmissions = [x for x in transmissions if x]
-
-					areas = []
-					for x in range(30,54): # 24
-						areas.append(fields[x])
-					areas = [x for x in areas if x]
-
-					serial_num_from = fields[54]
-					# fields[55] is a filler
-					serial_num_to = fields[56]
-
-					doors = []
-					for x in range(57,67): # 10
-						doors.append(fields[x])
-					doors = [x for x in doors if x]
-
-					grades = []
-					for x in range(67,93): # 26
-						grades.append(fields[x])
-					grades = [x for x in grades if x]
-
-					origins = []
-					for x in range(93,103): # 10
-						origins.append(fields[x])
-					origins = [x for x in origins if x]
-
-					qty_req =  fields[103].lstrip()
-					part_num = fields[104]
+					illustration_ref_num, line_desc, line_desc_cont, years, transmissions, areas, serial_num_from, serial_num_to, doors, grades, origins, qty_req, part_num = decode_record_30(row)
+					line_desc = line_desc.replace('(','').replace(')','')
+					qty_req = qty_req.lstrip()
 
 					# process line for entry into illustrations_part_df and part_df dataframes
 					if line_desc_cont == '01':
@@ -995,7 +1597,7 @@ def parse_raw_ahm_catalog(file):
 							part_disc = 1
 
 					# insert into part_df if part_num does not already exist
-					if not (part_df['mpn'] == part_num).any():
+					if not part_num in part_mpns:
 						# if the part does not exist, clear identifying info from last part
 						part_color = None
 						part_comment = None
@@ -1010,78 +1612,201 @@ def parse_raw_ahm_catalog(file):
 						# create the new part record
 						new_part = {'mpn_stripped':mpn_stripped, 'mpn':part_num, 'manufacturer':vehicle_make, 'part_name':part_name, 'color':part_color, 'comment':part_comment, 'superseded_by':part_super, 'discontinued':part_disc}
 						# print('creating new part')
-						part_df = part_df.append(new_part, ignore_index=True)
+						part_mpns.add(part_num)
+						# the first part registered for a stripped mpn is the one that is kept
+						if not mpn_stripped in parts:
+							parts[mpn_stripped] = new_part
 					# assign color to matching mpns that were processed before the color row
 					if part_color != None:
-						part_df.loc[part_df.mpn_stripped == mpn_stripped, 'color'] = part_color
+						parts[mpn_stripped]['color'] = part_color
 						# print("setting color on " + mpn_stripped)
 					# assign comments to matching mpns that were processed before the comment row
 					if part_comment != None:
-						part_df.loc[part_df.mpn_stripped == mpn_stripped, 'comment'] = part_comment
+						parts[mpn_stripped]['comment'] = part_comment
 						# print("setting comment on " + mpn_stripped)
 					# assign comments to matching mpns that were processed before the comment row
 					if part_super != None:
-						part_df.loc[part_df.mpn_stripped == mpn_stripped, 'superseded_by'] = part_super
+						parts[mpn_stripped]['superseded_by'] = part_super
 						# print("setting supersedence on " + mpn_stripped)
 					# assign comments to matching mpns that were processed before the comment row
 					if part_disc != None:
-						part_df.loc[part_df.mpn_stripped == mpn_stripped, 'discontinued'] = part_disc
+						parts[mpn_stripped]['discontinued'] = part_disc
 						# print("setting discontinued on " + mpn_stripped)
 					# insert into illustration_part_df
-					# one record for every unique option, loop through all lists
-					for year in years:
-						for transmission in transmissions:
-							for area in areas:
-								for door in doors:
-									for grade in grades:
-										for origin in origins:
-											# grab everything that begins with U or C for north american markets (usa, can)
-											search = re.search(r"(U|C)", origin, flags=re.IGNORECASE)
-											if search is not None:
-												# get valid year option
-												year = [x for x in valid_years if x.endswith(year)][0]
-												if int(year) <= 40: # this should be the number where you think it stops to be 20xx (like 15 for 2015; for every number after that it will be 19xx)
-													search_year = int(year) + 2000
-												else:
-													search_year = int(year) + 1900
-												# get vehicle from options
-												vehicle = vehicle_df[(vehicle_df['make'] == vehicle_make) & (vehicle_df['model'] == vehicle_model) & (vehicle_df['year'] == search_year) & (vehicle_df['doors'] == door) & (vehicle_df['trans'] == transmission) & (vehicle_df['emissions'] == area) & (vehicle_df['trim'] == grade_definitions[grade]) & (vehicle_df['origin'] == origin)]
-												vehicle = vehicle.index.values[0]
-												new_illustration_part = [
-													mpn_stripped,
-													record_30_block_num,
-													illustration_ref_num,
-													vehicle,
-													qty_req,
-													serial_num_from,
-													serial_num_to,
-													origin
-												]
-												new_illustration_part_list.append(new_illustration_part)
-	
-	illustration_part_df = pd.DataFrame(new_illustration_part_list, columns=['mpn_stripped','illustration_ref_id','illustration_ref_num','car_id','qty_req','vin_serial_from','vin_serial_to','region'])
+					# one record for every unique option. origins outside north america and the year/grade lookups are
+					# resolved once per row, the cartesian product is expanded per block by expand_fitments
+					fitment_origins = [x for x in origins if north_america_origin.search(x)]
+					if years and transmissions and areas and doors and grades and fitment_origins:
+						fitment_years = [get_model_year(valid_years, x) for x in years]
+						fitment_grades = [grade_definitions[x] for x in grades]
+						fitment_rows.append([mpn_stripped, record_30_block_num, illustration_ref_num, qty_req, serial_num_from, serial_num_to, vehicle_make, vehicle_model, fitment_years, transmissions, areas, doors, fitment_grades, fitment_origins])
+
+		# expand the fitments of the last block
+		if fitment_rows:
+			illustration_part_frames.append(expand_fitments(fitment_rows, get_vehicle_table(vehicle_index)))
+
+	if illustration_part_spill is not None:
+		illustration_part_df = illustration_part_spill
+	elif illustration_part_frames:
+		illustration_part_df = pd.concat(illustration_part_frames, ignore_index=True)
+	else:
+		illustration_part_df = pd.DataFrame(columns=illustration_part_columns)
+	catalog_df = pd.DataFrame(catalog_rows, columns=catalog_columns, dtype=object)
+	illustration_df = pd.DataFrame(illustration_rows, columns=illustration_columns, dtype=object)
+	vehicle_df = pd.DataFrame(vehicle_rows, columns=vehicle_columns, dtype=object)
+	part_df = pd.DataFrame(list(parts.values()), columns=part_columns, dtype=object)
 	# remove any duplicates from the dataframes, set indices if required
 	catalog_df = catalog_df.drop_duplicates().dropna(how='all',axis=0)
 	illustration_df = illustration_df.drop_duplicates().dropna(how='all',axis=0).set_index('ref_id')
 	vehicle_df = vehicle_df.drop_duplicates().dropna(how='all',axis=0)
 	part_df = part_df.set_index('mpn_stripped')
 	part_df = part_df[~part_df.index.duplicated(keep='first')].dropna(how='all',axis=0)
-	illustration_part_df = illustration_part_df.drop_duplicates().dropna(how='all',axis=0)
+	# spilled illustration parts are deduplicated bucket by bucket when they are read back
+	if illustration_part_spill is None:
+		catalog_metrics.count('expanded_fitment_rows', len(illustration_part_df))
+		illustration_part_df = illustration_part_df.drop_duplicates().dropna(how='all',axis=0)
+		catalog_metrics.count('fitment_rows', len(illustration_part_df))
+	else:
+		# fitment_rows of a spilled catalog are counted by export_spilled_classifications
+		catalog_metrics.count('expanded_fitment_rows', illustration_part_spill.rows)
 
 	# set car_id to string to hold MD5 hash
 	vehicle_df.car_id = vehicle_df.car_id.astype(str)
 
+	for row_type, count in record_counts.items():
+		catalog_metrics.count('record_' + row_type + '_rows', count)
+	catalog_metrics.count('vehicles', len(vehicle_df))
+	catalog_metrics.count('illustrations', len(illustration_df))
+
 	# clean up part_df for disabled regions
 	# get row indexes of mpn's in illustration_part_df
-	mpn_list = illustration_part_df['mpn_stripped'].tolist()
+	if illustration_part_spill is None:
+		mpn_list = illustration_part_df['mpn_stripped'].tolist()
+	else:
+		mpn_list = list(illustration_part_spill.mpns)
 	part_df = part_df.loc[part_df.index.intersection(mpn_list)]
 
+	catalog_metrics.count('parts', len(part_df))
+
 	return catalog_df, illustration_df, vehicle_df, part_df, illustration_part_df
 
+class CsvTableWriter:
+	# utf-8 csv exports, the format read by the PHP importer
+	extension = '.csv'
+
+	def write(self, frame, path, index=False):
+		with open(path, "w") as f:
+			frame.to_csv(f, encoding='utf-8', index=index)
+
+	@contextlib.contextmanager
+	def stream(self, path, columns):
+		# write the header, then yield a function appending the rows of a frame
+		with open(path, "w") as f:
+			pd.DataFrame(columns=columns).to_csv(f, encoding='utf-8', index=False)
+			yield lambda frame: frame.to_csv(f, encoding='utf-8', index=False, header=False)
+
+	def combine(self, paths, output_path, columns):
+		combine_csv_files(paths, output_path, columns)
+
+# columns written as integers and floats in parquet exports, other columns keep the type pyarrow infers and
+# columns without any values are written as strings
+parquet_column_types = {
+	'make_id':'int64',
+	'year':'int64',
+	'has_parts':'int64',
+	'has_accessories':'int64',
+	'position_id':'float64',
+	'width':'int64',
+	'height':'int64',
+	'source':'int64',
+	'orig_width':'int64',
+	'orig_height':'int64',
+}
+
+# low cardinality columns dictionary encoded in parquet exports
+parquet_dictionary_columns = ['db_group', 'db_subgroup', 'group', 'subgroup', 'make', 'position']
+
+def get_arrow_table(frame):
+	table = pa.Table.from_pandas(frame, preserve_index=False)
+	for x, name in enumerate(table.column_names):
+		column = table.column(x)
+		if name in parquet_dictionary_columns:
+			column = column.cast(pa.string()).dictionary_encode()
+		elif name in parquet_column_types:
+			column = column.cast(parquet_column_types[name])
+		elif pa.types.is_null(column.type):
+			column = column.cast(pa.string())
+		table = table.set_column(x, name, column)
+	# pandas metadata differs between chunks of the same table
+	return table.replace_schema_metadata(None)
+
+class ParquetTableWriter:
+	# typed parquet exports for analytics jobs
+	extension = '.parquet'
+
+	def write(self, frame, path, index=False):
+		if index:
+			frame = frame.reset_index()
+		pq.write_table(get_arrow_table(frame), str(path))
+
+	@contextlib.contextmanager
+	def stream(self, path, columns):
+		# yield a function appending the rows of a frame as a row group. the first frame sets the schema
+		writers = []
+
+		def append(frame):
+			table = get_arrow_table(frame)
+			if not writers:
+				writers.append(pq.ParquetWriter(str(path), table.schema))
+			writers[0].write_table(table.cast(writers[0].schema))
+
+		try:
+			yield append
+		finally:
+			if writers:
+				writers[0].close()
+		if not writers:
+			self.write(pd.DataFrame(columns=columns), path)
+
+	def combine(self, paths, output_path, columns):
+		# write the row groups of each file to output_path. a partial output is removed on failure, the inputs are
+		# left for the caller
+		writer = None
+		try:
+			for path in paths:
+				parquet_file = pq.ParquetFile(str(path))
+				schema = parquet_file.schema_arrow
+				if writer is None:
+					writer = pq.ParquetWriter(str(output_path), schema)
+				elif schema.names != writer.schema.names:
+					raise ValueError('Columns of ' + path.name + ' do not match ' + paths[0].name + ': ' + ','.join(schema.names) + ' != ' + ','.join(writer.schema.names))
+				for batch in parquet_file.iter_batches():
+					writer.write_table(pa.Table.from_batches([batch]).cast(writer.schema))
+			if writer is None:
+				# without any inputs the output is an empty table
+				self.write(pd.DataFrame(columns=columns), output_path)
+			else:
+				writer.close()
+		except BaseException:
+			# never leave a partial output behind
+			if writer is not None:
+				writer.close()
+			output_path.unlink(missing_ok=True)
+			raise
+
+table_writers = {'csv':CsvTableWriter, 'parquet':ParquetTableWriter}
+
+def get_table_writer():
+	if export_format not in table_writers:
+		raise ValueError('Unknown export format: ' + export_format)
+	if export_format == 'parquet' and not importlib.util.find_spec('pyarrow'):
+		raise ValueError('Parquet exports require pyarrow')
+	return table_writers[export_format]()
+
 def export_blank_hotspot_dataframe():
-	with open(processed_illustrations_dir / 'rp_illustration_hotspots.csv', "w") as f:
-		rp_illustration_hotspots = pd.DataFrame(columns=['imageID','referenceCode','x','y','width','height','part_source','filename','original_image_width','original_image_height','width_to_height_ratio','processed_file_checksum'])
-		rp_illustration_hotspots.to_csv(f, encoding='utf-8', index=False)
+	table_writer = get_table_writer()
+	rp_illustration_hotspots = pd.DataFrame(columns=['imageID','referenceCode','x','y','width','height','part_source','filename','original_image_width','original_image_height','width_to_height_ratio','processed_file_checksum'])
+	table_writer.write(rp_illustration_hotspots, processed_illustrations_dir / ('rp_illustration_hotspots' + table_writer.extension))
 
 def export_intermediate_df_to_csv(catalog_id, illustration_df, vehicle_df, part_df, illustration_part_df):
 
@@ -1091,135 +1816,278 @@ def export_intermediate_df_to_csv(catalog_id, illustration_df, vehicle_df, part_
 	except FileExistsError:
 		pass
 
-	with open(intermediate_dir / (str(catalog_id) + '_IllustrationInfo.csv'), "w") as f:
-		illustration_df.to_csv(f, encoding='utf-8')
-	with open(intermediate_dir / (str(catalog_id) + '_VehicleInfo.csv'), "w") as f:
-		vehicle_df.to_csv(f, encoding='utf-8')
-	with open(intermediate_dir / (str(catalog_id) + '_PartInfo.csv'), "w") as f:
-		part_df.to_csv(f, encoding='utf-8')
-	with open(intermediate_dir / (str(catalog_id) + '_IllustrationPartInfo.csv'), "w") as f:
-		illustration_part_df.to_csv(f, encoding='utf-8')
+	# written in the export format, with their index
+	table_writer = get_table_writer()
+	table_writer.write(illustration_df, intermediate_dir / (str(catalog_id) + '_IllustrationInfo' + table_writer.extension), index=True)
+	table_writer.write(vehicle_df, intermediate_dir / (str(catalog_id) + '_VehicleInfo' + table_writer.extension), index=True)
+	table_writer.write(part_df, intermediate_dir / (str(catalog_id) + '_PartInfo' + table_writer.extension), index=True)
+	table_writer.write(illustration_part_df, intermediate_dir / (str(catalog_id) + '_IllustrationPartInfo' + table_writer.extension), index=True)
 
 def export_final_dataframes_to_csv(catalog_id, rp_car, class_honda_us, class_honda_can, class_acura_us, class_acura_can, rp_illustration_info, rp_vin_masks):
-	with open(processed_dir / (str(catalog_id) + '_rp_car.csv'), "w") as f:
-		rp_car.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / (str(catalog_id) + '_classification_honda.csv'), "w") as f:
-		class_honda_us.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / (str(catalog_id) + '_classification_honda_ca.csv'), "w") as f:
-		class_honda_can.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / (str(catalog_id) + '_classification_acura.csv'), "w") as f:
-		class_acura_us.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / (str(catalog_id) + '_classification_acura_ca.csv'), "w") as f:
-		class_acura_can.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_illustrations_dir / (str(catalog_id) + '_rp_illustration_info.csv'), "w") as f:
-		rp_illustration_info.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / (str(catalog_id) + '_rp_vin_masks.csv'), "w") as f:
-		rp_vin_masks.to_csv(f, encoding='utf-8', index=False)
-
-def combine_final_dataframes():
-
-	# create empty filename lists
-	rp_car_files = []
-	class_files_honda = []
-	class_files_honda_ca = []
-	class_files_acura = []
-	class_files_acura_ca = []
-	rp_vin_masks_files = []
-	rp_illust_files = []
-
-	# sort file names into lists
-	for path in processed_dir.iterdir():
-		if path.is_file() and path.name.endswith('rp_car.csv'):
-			rp_car_files.append(path)
-		if path.is_file() and path.name.endswith('classification_honda.csv'):
-			class_files_honda.append(path)
-		if path.is_file() and path.name.endswith('classification_honda_ca.csv'):
-			class_files_honda_ca.append(path)
-		if path.is_file() and path.name.endswith('classification_acura.csv'):
-			class_files_acura.append(path)
-		if path.is_file() and path.name.endswith('classification_acura_ca.csv'):
-			class_files_acura_ca.append(path)
-		if path.is_file() and path.name.endswith('rp_vin_masks.csv'):
-			rp_vin_masks_files.append(path)
-	
-	for path in processed_illustrations_dir.iterdir():
-		if path.is_file() and path.name.endswith('rp_illustration_info.csv'):
-			rp_illust_files.append(path)
-
-	#combine all files in the list
-	rp_car_combined_csv = pd.concat([pd.read_csv(f) for f in rp_car_files])
-	rp_illust_combined_csv = pd.concat([pd.read_csv(f) for f in rp_illust_files])
-	rp_vin_masks_combined_csv = pd.concat([pd.read_csv(f) for f in rp_vin_masks_files])
-	class_honda_combined_csv = pd.concat([pd.read_csv(f) for f in class_files_honda])
-	class_honda_ca_combined_csv = pd.concat([pd.read_csv(f) for f in class_files_honda])
-	class_acura_combined_csv = pd.concat([pd.read_csv(f) for f in class_files_acura])
-	class_acura_ca_combined_csv = pd.concat([pd.read_csv(f) for f in class_files_acura_ca])
-
-	# remove all files in processed directory
-	for path in processed_dir.iterdir():
-		try:
-			path.unlink()
-		except:
-			pass
-	
-	for path in processed_illustrations_dir.iterdir():
-		try:
-			path.unlink()
-		except:
-			pass
-
-	#export to new files to csv
-	with open(processed_dir / 'rp_car.csv', "w") as f:
-		rp_car_combined_csv.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_illustrations_dir / 'rp_illustration_info.csv', "w") as f:
-		rp_illust_combined_csv.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / 'rp_vin_masks.csv', "w") as f:
-		rp_vin_masks_combined_csv.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / 'classification_honda.csv', "w") as f:
-		class_honda_combined_csv.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / 'classification_honda_ca.csv', "w") as f:
-		class_honda_ca_combined_csv.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / 'classification_acura.csv', "w") as f:
-		class_acura_combined_csv.to_csv(f, encoding='utf-8', index=False)
-	with open(processed_dir / 'classification_acura_ca.csv', "w") as f:
-		class_acura_ca_combined_csv.to_csv(f, encoding='utf-8', index=False)
-
-if __name__ == "__main__":
+	# written in the export format, csv unless --export-format says otherwise.
+	# outputs passed as None were already written, e.g. streamed vin masks
+	table_writer = get_table_writer()
+	final_outputs = [
+		[rp_car, processed_dir, '_rp_car'],
+		[class_honda_us, processed_dir, '_classification_honda'],
+		[class_honda_can, processed_dir, '_classification_honda_ca'],
+		[class_acura_us, processed_dir, '_classification_acura'],
+		[class_acura_can, processed_dir, '_classification_acura_ca'],
+		[rp_illustration_info, processed_illustrations_dir, '_rp_illustration_info'],
+		[rp_vin_masks, processed_dir, '_rp_vin_masks'],
+	]
+	for frame, directory, suffix in final_outputs:
+		if frame is not None:
+			table_writer.write(frame, directory / (str(catalog_id) + suffix + table_writer.extension))
 
-	# get aces tables to pass to rp_car function
-	honda_aces = get_aces_table('honda')
-	acura_aces = get_aces_table('acura')
+def combine_csv_files(paths, output_path, columns, buffer_size=16*1024*1024):
+	# write the data rows of each csv to output_path, writing the header once. values are copied as each catalog
+	# wrote them. a partial output is removed on failure, the inputs are left for the caller
+	try:
+		header = None
+		with open(output_path, 'wb') as output_file:
+			for path in paths:
+				with open(path, 'rb') as input_file:
+					file_header = input_file.readline().rstrip(b'\r\n')
+					if header is None:
+						header = file_header
+						output_file.write(header + b'\n')
+					elif file_header != header:
+						raise ValueError('Header of ' + path.name + ' does not match ' + paths[0].name + ': ' + file_header.decode() + ' != ' + header.decode())
+					data_start = input_file.tell()
+					shutil.copyfileobj(input_file, output_file, buffer_size)
+					# keep rows on their own lines if a file does not end in a newline
+					if input_file.tell() > data_start:
+						input_file.seek(-1, os.SEEK_END)
+						if input_file.read(1) != b'\n':
+							output_file.write(b'\n')
+			# without any inputs the output is just the header
+			if header is None:
+				pd.DataFrame(columns=columns).to_csv(output_file, encoding='utf-8', index=False)
+	except BaseException:
+		# never leave a partial output behind
+		output_path.unlink(missing_ok=True)
+		raise
 
-	for path in temp_raw_dir.iterdir():
-		if path.is_file() and path.suffix == '.txt' and path.name == '13SD201.txt':
-			print('found file')
-			
-			try:
-				catalog_df, illustration_df, vehicle_df, part_df, illustration_part_df = parse_raw_ahm_catalog(path)
-				# if there are no valid parts, don't continue processing
-				if part_df.empty:
-					print('found empty part df')
-					continue
+def combine_final_dataframes():
 
-				catalog_id = catalog_df.iloc[0].id
-				# export_intermediate_df_to_csv(catalog_id, illustration_df, vehicle_df, part_df, illustration_part_df)
-				rp_car, vehicle_df, aces_validated_df = create_rp_car(vehicle_df, honda_aces, acura_aces)
+	# per catalog export suffix -> combined export, in each directory
+	combined_outputs = [
+		[processed_dir, '_rp_car', 'rp_car', rp_car_columns],
+		[processed_illustrations_dir, '_rp_illustration_info', 'rp_illustration_info', rp_illustration_info_columns],
+		[processed_dir, '_rp_vin_masks', 'rp_vin_masks', rp_vin_mask_columns],
+		[processed_dir, '_classification_honda', 'classification_honda', classification_columns],
+		[processed_dir, '_classification_honda_ca', 'classification_honda_ca', classification_columns],
+		[processed_dir, '_classification_acura', 'classification_acura', classification_columns],
+		[processed_dir, '_classification_acura_ca', 'classification_acura_ca', classification_columns],
+	]
 
-				rp_vin_mask = create_rp_vin_masks(aces_validated_df)
+	# every output is combined into a temp file first. only when all of them succeed are they renamed into place
+	# and their inputs removed, so a bad input never leaves a mix of old and new outputs
+	table_writer = get_table_writer()
+	combined = []
+	try:
+		for directory, suffix, combined_name, columns in combined_outputs:
+			# sort file names so the combined order is the same on every run
+			paths = sorted([path for path in directory.iterdir() if path.is_file() and path.name.endswith(suffix + table_writer.extension)])
+			output_path = directory / (combined_name + table_writer.extension)
+			temp_path = output_path.with_name('.' + output_path.name + '.tmp')
+			combined.append([paths, temp_path, output_path])
+			table_writer.combine(paths, temp_path, columns)
+	except BaseException:
+		for paths, temp_path, output_path in combined:
+			temp_path.unlink(missing_ok=True)
+		raise
+
+	for paths, temp_path, output_path in combined:
+		os.replace(temp_path, output_path)
+	for paths, temp_path, output_path in combined:
+		for path in paths:
+			path.unlink()
 
-				rp_illustration_info = create_rp_illustration_info(illustration_df)
-				
+def process_catalog(catalog_name, source):
+	# run one catalog from parse to csv export. returns a record of the outcome for the manifest and the run log.
+	# honda_aces, acura_aces, manifest and aces_fingerprint are module globals set by __main__, which worker
+	# processes inherit when they are forked
+	global catalog_metrics
+	catalog_metrics = CatalogMetrics(catalog_name)
+	start_time = time.perf_counter()
+	record = {'catalog_name':catalog_name, 'catalog_id':None, 'catalog_hash':None, 'status':None, 'seconds':None, 'error':None}
+
+	# large catalogs spill their illustration parts to disk
+	illustration_part_spill = None
+	try:
+		with catalog_metrics.stage('hash'):
+			catalog_hash = get_catalog_hash(catalog_name, source)
+		record['catalog_hash'] = catalog_hash
+		if restore_catalog_outputs(manifest, catalog_name, catalog_hash, aces_fingerprint):
+			print('catalog unchanged, reusing previous outputs')
+			record['status'] = 'reused'
+			return record
+
+		if spill_buckets > 0:
+			illustration_part_spill = IllustrationPartSpill(base_dir / 'working/spill' / catalog_name, spill_buckets)
+
+		with catalog_metrics.stage('parse'):
+			catalog_df, illustration_df, vehicle_df, part_df, illustration_part_df = parse_raw_ahm_catalog(source, illustration_part_spill)
+		# if there are no valid parts, don't continue processing
+		if part_df.empty:
+			print('found empty part df')
+			record['status'] = 'empty'
+			return record
+
+		catalog_id = catalog_df.iloc[0].id
+		record['catalog_id'] = str(catalog_id)
+		# export_intermediate_df_to_csv(catalog_id, illustration_df, vehicle_df, part_df, illustration_part_df)
+		with catalog_metrics.stage('rp_car'):
+			rp_car, vehicle_df, aces_validated_df = create_rp_car(vehicle_df, honda_aces, acura_aces)
+
+		with catalog_metrics.stage('illustration_info'):
+			rp_illustration_info = create_rp_illustration_info(illustration_df, catalog_id=catalog_id)
+
+		if illustration_part_spill is None:
+			with catalog_metrics.stage('classifications'):
 				class_honda_us, class_honda_can, class_acura_us, class_acura_can = create_rp_classifications(vehicle_df, part_df, illustration_part_df, illustration_df)
+				write_position_map_report(catalog_id)
 
-				# process has_accessories, has_parts
+			# process has_accessories, has_parts
+			with catalog_metrics.stage('process_rp_car'):
 				rp_car = process_rp_car(rp_car, class_honda_us, class_honda_can, class_acura_us, class_acura_can)
+		else:
+			# spilled classifications are written to their csvs bucket by bucket
+			with catalog_metrics.stage('classifications'):
+				car_flags = export_spilled_classifications(catalog_id, vehicle_df, part_df, illustration_part_df, illustration_df)
+				write_position_map_report(catalog_id)
+			class_honda_us, class_honda_can, class_acura_us, class_acura_can = None, None, None, None
+
+			# process has_accessories, has_parts
+			with catalog_metrics.stage('process_rp_car'):
+				rp_car = apply_car_flags(rp_car, car_flags)
+
+		with catalog_metrics.stage('export'):
+			# vin masks are streamed to their csv
+			export_rp_vin_masks(catalog_id, aces_validated_df)
+			export_final_dataframes_to_csv(catalog_id, rp_car,class_honda_us, class_honda_can, class_acura_us, class_acura_can, rp_illustration_info, None)
+		catalog_metrics.count('cars', len(rp_car))
+		catalog_metrics.count('vin_masks', len(aces_validated_df))
+		record['status'] = 'processed'
+	except Exception as err:
+		record['status'] = 'failed'
+		record['error'] = {'type':type(err).__name__, 'message':str(err), 'traceback':traceback.format_exc()}
+		unmapped_positions.clear()
+		if record['catalog_id'] is not None:
+			remove_catalog_outputs(record['catalog_id'])
+	except BaseException:
+		# an interrupted run must not leave part of this catalog for the next combine either
+		if record['catalog_id'] is not None:
+			remove_catalog_outputs(record['catalog_id'])
+		raise
+	finally:
+		if illustration_part_spill is not None:
+			illustration_part_spill.remove()
+		record['seconds'] = round(time.perf_counter() - start_time, 3)
+		record['metrics'] = catalog_metrics.to_dict()
+
+	return record
+
+def get_lost_catalog_record(catalog_name, err, seconds):
+	# record of a catalog whose worker process died (e.g. killed for memory) before it could return one
+	return {'catalog_name':catalog_name, 'catalog_id':None, 'catalog_hash':None, 'status':'failed', 'seconds':round(seconds, 3),
+		'error':{'type':type(err).__name__, 'message':str(err), 'traceback':''.join(traceback.format_exception(type(err), err, err.__traceback__))},
+		'metrics':CatalogMetrics(catalog_name).to_dict()}
+
+def write_catalog_metrics(records, seconds):
+	# append one json line of stage timings and counts per catalog, then a summary line of the whole run
+	date_time = str(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+	log = ''
+	stages = collections.OrderedDict()
+	counts = collections.Counter()
+	statuses = collections.Counter()
+	for record in records:
+		log = log + json.dumps({'time':date_time, 'catalog_name':record['catalog_name'], 'catalog_id':record['catalog_id'], 'status':record['status'], 'seconds':record['seconds'], 'stages':record['metrics']['stages'], 'counts':record['metrics']['counts']}) + '\n'
+		for stage, stage_seconds in record['metrics']['stages'].items():
+			stages[stage] = stages.get(stage, 0) + stage_seconds
+		counts.update(record['metrics']['counts'])
+		statuses[record['status']] += 1
+	summary = {'time':date_time, 'summary':True, 'catalogs':len(records), 'statuses':dict(statuses), 'seconds':round(seconds, 3), 'stages':{x:round(y, 3) for x, y in stages.items()}, 'counts':dict(counts)}
+	log = log + json.dumps(summary) + '\n'
+	file_path = temp_raw_dir.resolve().parent / "CatalogMetrics.txt"
+	file1 = open(file_path, "a+")
+	file1.write(log)
+	file1.close()
+
+	# stage totals, slowest first. with --workers these add up the time spent in every process
+	print('%d catalogs in %.1fs: %s' % (len(records), seconds, ', '.join('%d %s' % (y, x) for x, y in statuses.items())))
+	for stage, stage_seconds in sorted(stages.items(), key=lambda x: x[1], reverse=True):
+		print('  %s: %.1fs' % (stage, stage_seconds))
+
+def write_catalog_errors(records):
+	# append one json line per failed catalog
+	log = ''
+	date_time = str(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+	for record in records:
+		if record['status'] == 'failed':
+			log = log + json.dumps(dict(record, time=date_time)) + '\n'
+	if log:
+		file_path = temp_raw_dir.resolve().parent / "CatalogErrors.txt"
+		file1 = open(file_path, "a+")
+		file1.write(log)
+		file1.close()
 
-				export_final_dataframes_to_csv(catalog_id, rp_car,class_honda_us, class_honda_can, class_acura_us, class_acura_can, rp_illustration_info, rp_vin_mask)
-			except:
-				
-				print('error')
-				continue
+if __name__ == "__main__":
+
+	# fail before any work if the export format can't be written
+	get_table_writer()
 
+	# get aces tables to pass to rp_car function
+	honda_aces = get_aces_snapshot('honda')
+	acura_aces = get_aces_snapshot('acura')
+
+	# catalogs whose rows and ACES data are unchanged reuse their previous outputs
+	manifest = load_catalog_manifest()
+	aces_fingerprint = get_aces_fingerprint(honda_aces, acura_aces)
+
+	# matchers memoize ACES lookups across all catalogs of the run
+	honda_aces = AcesMatcher(honda_aces)
+	acura_aces = AcesMatcher(acura_aces)
+
+	start_time = time.perf_counter()
+	catalogs = []
+	for catalog_name, source in get_catalog_sources():
+		if catalog_names is None or catalog_name in catalog_names:
+			catalogs.append((catalog_name, source))
+
+	if workers > 1:
+		# catalogs already run in parallel, nested image pools would oversubscribe the cpus
+		image_workers = 1
+		# forked workers share the ACES matchers and manifest above without pickling them
+		catalog_records = {}
+		with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'), initializer=init_catalog_worker) as executor:
+			futures = {executor.submit(process_catalog, catalog_name, source): catalog_name for catalog_name, source in catalogs}
+			for future in as_completed(futures):
+				catalog_name = futures[future]
+				try:
+					catalog_records[catalog_name] = future.result()
+				except Exception as err:
+					# a dead worker breaks the pool, failing every catalog that had not finished. the catalogs that did
+					# finish are still stored and combined below. output files are named by the catalog id, which is the
+					# catalog name the raw file was split on
+					catalog_records[catalog_name] = get_lost_catalog_record(catalog_name, err, time.perf_counter() - start_time)
+					remove_catalog_outputs(catalog_name)
+		records = [catalog_records[x[0]] for x in catalogs]
+	else:
+		records = [process_catalog(catalog_name, source) for catalog_name, source in catalogs]
+
+	# the manifest is only updated here, workers never write to it
+	for record in records:
+		print('%s: %s in %.1fs' % (record['catalog_name'], record['status'], record['seconds']))
+		if record['status'] == 'failed':
+			print('error: ' + record['error']['type'] + ': ' + record['error']['message'])
+		if record['status'] in ('processed', 'empty'):
+			store_catalog_outputs(manifest, record['catalog_name'], record['catalog_hash'], aces_fingerprint, record['catalog_id'])
+	write_catalog_errors(records)
+	write_catalog_metrics(records, time.perf_counter() - start_time)
+	save_catalog_manifest(manifest)
 
 	combine_final_dataframes()
 	export_blank_hotspot_dataframe()